@@ -64,5 +64,12 @@ setup(
       # -*- Entry points: -*-
       [z3c.autoinclude.plugin]
       target = plone
+
+      [zopectl.command]
+      archive_fulltext = senaite.archive.fulltext:run
+      archive_export = senaite.archive.export:run
+      archive_restore = senaite.archive.restore:run
+      archive_benchmark = senaite.archive.benchmark:run
+      archive_cache = senaite.archive.cache:run
       """,
 )
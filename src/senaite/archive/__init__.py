@@ -64,3 +64,11 @@ def initialize(context):
         permission_name = getattr(permissions, permission_id)
         security.declarePublic(permission_id)
         addPermission(permission_name, default_roles=("Manager", ))
+
+    # Register the index for the searchable text of archive items
+    from senaite.archive.catalog.textindex import ArchiveTextIndex
+    from senaite.archive.catalog.textindex import manage_addArchiveTextIndex
+    context.registerClass(ArchiveTextIndex,
+                          permission="Add Pluggable Index",
+                          constructors=(manage_addArchiveTextIndex, ),
+                          visibility=None)
@@ -19,14 +19,12 @@
 # Some rights reserved, see README and LICENSE.
 
 from senaite.archive.interfaces import IArchiveFolder
-from senaite.archive.utils import can_archive
+from senaite.archive.utils import archive_objects
+from senaite.archive.utils import get_objects
 from senaite.archive.utils import queue_do_archive
 from zope.component import adapter
 from zope.interface import implementer
 
-from bika.lims import api
-from bika.lims.workflow import doActionFor
-
 try:
     from senaite.queue.interfaces import IQueuedTaskAdapter
 except:
@@ -46,11 +44,11 @@ class QueuedDoArchiveTaskAdapter(object):
     def process(self, task):
         """Transition the objects from the task
         """
-        # Extract and process the objects
-        for uid in task.uids:
-            obj = api.get_object_by_uid(uid, default=None)
-            if can_archive(obj):
-                doActionFor(obj, "archive")
+        # Extract and process the objects. All them are archived within the
+        # same chunk, so the archive items are indexed in a single pass. The
+        # objects are loaded in bulk and the archival is planned again, cause
+        # the status of the objects might have changed since the task was added
+        archive_objects(get_objects(task.uids))
 
         # Add next chunk of objects to the queue
         chunk_size = task.get("chunk_size", 10)
@@ -39,6 +39,11 @@ class IArchiveItemBehavior(model.Schema):
         required=True,
     )
 
+    item_uid = schema.TextLine(
+        title=_(u"Item UID"),
+        required=False,
+    )
+
     item_id = schema.TextLine(
         title=_(u"Item ID"),
         required=True,
@@ -66,6 +71,21 @@ class IArchiveItemBehavior(model.Schema):
         required=True,
     )
 
+    item_client = schema.TextLine(
+        title=_(u"Item client"),
+        required=False,
+    )
+
+    item_sample_type = schema.TextLine(
+        title=_(u"Item sample type"),
+        required=False,
+    )
+
+    item_review_state = schema.TextLine(
+        title=_(u"Item status"),
+        required=False,
+    )
+
     directives.omitted("search_text")
     search_text = schema.Text(
         title=_(u"Searchable text"),
@@ -94,6 +114,14 @@ class ArchiveItem(object):
 
     item_type = property(_get_item_type, _set_item_type)
 
+    def _get_item_uid(self):
+        return getattr(self.context, "item_uid", "")
+
+    def _set_item_uid(self, value):
+        self.context.item_uid = value
+
+    item_uid = property(_get_item_uid, _set_item_uid)
+
     def _get_item_id(self):
         return getattr(self.context, "item_id")
 
@@ -136,6 +164,31 @@ class ArchiveItem(object):
 
     item_modified = property(_get_item_modified, _set_item_modified)
 
+    def _get_item_client(self):
+        return getattr(self.context, "item_client", "")
+
+    def _set_item_client(self, value):
+        self.context.item_client = value
+
+    item_client = property(_get_item_client, _set_item_client)
+
+    def _get_item_sample_type(self):
+        return getattr(self.context, "item_sample_type", "")
+
+    def _set_item_sample_type(self, value):
+        self.context.item_sample_type = value
+
+    item_sample_type = property(_get_item_sample_type, _set_item_sample_type)
+
+    def _get_item_review_state(self):
+        return getattr(self.context, "item_review_state", "")
+
+    def _set_item_review_state(self, value):
+        self.context.item_review_state = value
+
+    item_review_state = property(_get_item_review_state,
+                                 _set_item_review_state)
+
     def _get_search_text(self):
         return getattr(self.context, "search_text")
 
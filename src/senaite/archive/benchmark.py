@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.ARCHIVE.
+#
+# SENAITE.ARCHIVE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+
+import sys
+import time
+
+import transaction
+
+from Acquisition import aq_base
+from senaite.archive import logger
+from senaite.archive.catalog import CATALOG_ARCHIVE
+
+from bika.lims import api
+
+
+def is_ghost(obj):
+    """Returns whether the persistent object passed-in has not been loaded
+    from the database
+    """
+    return aq_base(obj)._p_changed is None
+
+
+def benchmark_listing(archive, request, pagesize=1000):
+    """Renders the items of the first page of the archive listing, with the
+    page size passed-in, and returns a tuple (seconds, loads, woken), with the
+    seconds spent, the number of objects loaded from the database and the ids
+    of the archive items that were woken up while rendering
+    """
+    from senaite.archive.browser.archivefolder import ArchiveFolderView
+
+    view = ArchiveFolderView(archive, request)
+    form_id = view.get_form_id()
+    request.form["{}_pagesize".format(form_id)] = pagesize
+
+    # Same as the listing does when called
+    view.portal = api.get_portal()
+    view.mtool = api.get_tool("portal_membership")
+    view.workflow = api.get_tool("portal_workflow")
+    view.member = api.get_current_user()
+    view.translate = archive.translate
+    view.update()
+    view.before_render()
+
+    # Start with a cold cache of the database connection
+    connection = archive._p_jar  # noqa
+    connection.cacheMinimize()
+    connection.getTransferCounts(clear=True)
+
+    start = time.time()
+    items = view.folderitems()
+    seconds = time.time() - start
+    loads = connection.getTransferCounts()[0]
+
+    ids = map(lambda item: item["id"], items)
+    woken = filter(lambda obj_id: not is_ghost(archive._getOb(obj_id)), ids)
+    logger.info("Rendered {} items in {:.3f}s with {} objects loaded".format(
+        len(items), seconds, loads))
+    return seconds, loads, woken
+
+
+def get_search_terms(num=20):
+    """Returns a list of search terms built from the ids and clients of the
+    first archive items, as the listing sends them: prefixes of single words
+    and of several words, wrapped in wildcards
+    """
+    query = {"portal_type": "ArchiveItem", "sort_on": "item_created",
+             "sort_limit": num}
+    brains = api.search(query, CATALOG_ARCHIVE)[:num]
+    terms = []
+    for brain in brains:
+        terms.append(u"*{}*".format(brain.item_id[:-2]))
+        words = u" ".join(filter(None, [brain.item_client, brain.item_id]))
+        terms.append(u"*{}*".format(words[:-2]))
+    return terms
+
+
+def benchmark_search(terms, index_name="listing_searchable_text"):
+    """Searches the terms passed-in in the text index of the archive catalog
+    and returns a tuple (seconds, matches) with the seconds spent and the
+    total number of archive items found
+    """
+    catalog = api.get_tool(CATALOG_ARCHIVE)
+    matches = 0
+    start = time.time()
+    for term in terms:
+        matches += len(catalog({index_name: term}))
+    seconds = time.time() - start
+    logger.info("Searched {} terms in {:.3f}s with {} matches".format(
+        len(terms), seconds, matches))
+    return seconds, matches
+
+
+def compare_text_indexes(terms, index_name="listing_searchable_text"):
+    """Indexes the archive items in a temporary ArchiveTextIndex and searches
+    the terms passed-in both in the text index of the archive catalog and in
+    the temporary index. Returns a list of (meta_type, seconds, matches)
+    tuples, one per index. Meant to compare the TextIndexNG3 index with the
+    ArchiveTextIndex before the former is replaced (upgrade step 1008). The
+    transaction must be aborted afterwards
+    """
+    from senaite.archive.catalog.textindex import ArchiveTextIndex
+
+    catalog = api.get_tool(CATALOG_ARCHIVE)
+    index = catalog._catalog.getIndex(index_name)  # noqa
+    temp_name = "{}_benchmark".format(index_name)
+    extra = {"indexed_attrs": index_name}
+    catalog.addIndex(temp_name, ArchiveTextIndex(temp_name, extra=extra))
+    logger.info("Indexing archive items in '{}' ...".format(temp_name))
+    catalog.reindexIndex(temp_name, api.get_request())
+
+    results = []
+    for name, meta_type in [(index_name, index.meta_type),
+                            (temp_name, ArchiveTextIndex.meta_type)]:
+        seconds, matches = benchmark_search(terms, index_name=name)
+        results.append((meta_type, seconds, matches))
+    return results
+
+
+def run(app, args):
+    """Runs the benchmark passed-in as the second argument against the site
+    passed-in as the first argument. Exits with an error if the benchmark
+    fails. Meant to be run as a zopectl command:
+
+        bin/instance archive_benchmark senaite listing [pagesize]
+        bin/instance archive_benchmark senaite search [num_items]
+        bin/instance archive_benchmark senaite compare [num_items]
+    """
+    from AccessControl.SecurityManagement import newSecurityManager
+    from AccessControl.SpecialUsers import system
+    from Testing.makerequest import makerequest
+    from zope.component.hooks import setSite
+
+    if len(args) < 2 or args[1] not in ["listing", "search", "compare"]:
+        print("Usage: archive_benchmark <site_id> listing [pagesize]")
+        print("       archive_benchmark <site_id> search [num_items]")
+        print("       archive_benchmark <site_id> compare [num_items]")
+        return
+
+    app = makerequest(app)
+    site = app[args[0]]
+    setSite(site)
+    newSecurityManager(None, system)
+    archive = site.archive
+
+    if args[1] == "compare":
+        num = len(args) > 2 and int(args[2]) or 20
+        terms = get_search_terms(num)
+        try:
+            results = compare_text_indexes(terms)
+        finally:
+            # The temporary index is never stored
+            transaction.abort()
+        for meta_type, seconds, matches in results:
+            print("{}: {} terms in {:.3f}s, {:.2f}ms per term, {} matches"
+                  .format(meta_type, len(terms), seconds,
+                          seconds * 1000 / max(len(terms), 1), matches))
+        return
+
+    if args[1] == "search":
+        num = len(args) > 2 and int(args[2]) or 20
+        terms = get_search_terms(num)
+        seconds, matches = benchmark_search(terms)
+        print("Search of {} terms: {:.3f}s, {:.2f}ms per term, {} "
+              "matches".format(len(terms), seconds,
+                               seconds * 1000 / max(len(terms), 1), matches))
+        return
+
+    pagesize = len(args) > 2 and int(args[2]) or 1000
+    seconds, loads, woken = benchmark_listing(archive, app.REQUEST, pagesize)
+    print("Listing of {} items: {:.3f}s, {} objects loaded".format(
+        pagesize, seconds, loads))
+    if woken:
+        print("Archive items woken up: {}".format(", ".join(woken)))
+        sys.exit(1)
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.ARCHIVE.
+#
+# SENAITE.ARCHIVE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+
+import gzip
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+
+from senaite.archive import logger
+from senaite.archive.cache import CACHE_DIRECTORY
+from senaite.archive.utils import get_archive_base_path
+from senaite.archive.utils import get_archived_files
+from zope.interface import implementer
+from ZPublisher.Iterators import IStreamIterator
+
+from bika.lims.browser import BrowserView
+
+# Number of bytes read from the file on each iteration
+CHUNK_SIZE = 1 << 16
+
+# Files smaller than this are not worth a compressed copy
+MIN_GZIP_SIZE = 1 << 10
+
+# Directory of the cache where the compressed copies are kept
+GZIP_DIRECTORY = "gzip"
+
+# Matches a single byte range of a Range header
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+@implementer(IStreamIterator)
+class FileStreamIterator(object):
+    """Iterates over a range of bytes of a file in chunks of fixed size, so
+    the file is never loaded in memory. The file is closed once consumed
+    """
+
+    def __init__(self, fileobj, start=0, end=None, chunk_size=CHUNK_SIZE):
+        if end is None:
+            fileobj.seek(0, os.SEEK_END)
+            end = fileobj.tell() - 1
+        fileobj.seek(start)
+        self.file = fileobj
+        self.remaining = end - start + 1
+        self.length = self.remaining
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.remaining <= 0:
+            self.file.close()
+            raise StopIteration
+        data = self.file.read(min(self.chunk_size, self.remaining))
+        if not data:
+            self.file.close()
+            raise StopIteration
+        self.remaining -= len(data)
+        return data
+
+    def __len__(self):
+        return self.length
+
+
+def parse_range(header, size):
+    """Returns a tuple (start, end) with the byte range from the Range header
+    passed-in, None if there is no range or is not supported (e.g. multiple
+    ranges) or False if the range is not satisfiable
+    """
+    match = RANGE_RE.match((header or "").strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # Suffix range: last n bytes
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start = int(start)
+        end = end and min(int(end), size - 1) or size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def parse_coding(value):
+    """Returns a tuple (coding, quality) from an item of the Accept-Encoding
+    header passed-in (e.g. "gzip;q=0.5"). The quality is 1 when not set and 0
+    when not valid
+    """
+    parts = value.split(";")
+    coding = parts[0].strip().lower()
+    quality = 1.0
+    for param in parts[1:]:
+        name, _, val = param.partition("=")
+        if name.strip().lower() != "q":
+            continue
+        try:
+            quality = float(val.strip())
+        except ValueError:
+            quality = 0.0
+    return coding, quality
+
+
+def get_gzip_path(file_path):
+    """Returns the path of the compressed copy of the file passed-in. Copies
+    are kept in the cache directory of the archive, apart from the archived
+    files, with the same relative path. The copy is created beforehand if it
+    does not exist or is outdated. Returns None if the file is too small to be
+    worth it or the copy cannot be created
+    """
+    base_path = get_archive_base_path()
+    rel_path = os.path.relpath(file_path, base_path)
+    gz_path = os.path.join(base_path, CACHE_DIRECTORY, GZIP_DIRECTORY,
+                           "{}.gz".format(rel_path))
+    stat = os.stat(file_path)
+    if stat.st_size < MIN_GZIP_SIZE:
+        return None
+    if os.path.exists(gz_path) and \
+            os.path.getmtime(gz_path) >= stat.st_mtime:
+        return gz_path
+
+    # Compress to a temporary file and rename, so concurrent requests never
+    # see a partially written copy
+    tmp_path = None
+    try:
+        gz_dir = os.path.dirname(gz_path)
+        if not os.path.isdir(gz_dir):
+            try:
+                os.makedirs(gz_dir)
+            except OSError:
+                # Created by a concurrent request
+                if not os.path.isdir(gz_dir):
+                    raise
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=gz_dir)
+        with os.fdopen(fd, "wb") as tmp_file:
+            with gzip.GzipFile(fileobj=tmp_file, mode="wb") as gz_file:
+                with open(file_path, "rb") as source:
+                    shutil.copyfileobj(source, gz_file, CHUNK_SIZE)
+        os.rename(tmp_path, gz_path)
+    except (IOError, OSError) as e:
+        logger.warn("Cannot compress {}: {}".format(file_path, e))
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+    return gz_path
+
+
+class ArchiveDownloadView(BrowserView):
+    """Streams the files the object represented by the archive item was
+    archived to. A single file is returned when its path (relative to the
+    directory of the archived object) is passed-in with the file parameter,
+    or a zip with all the files otherwise. Range, ETag and If-None-Match are
+    supported, and the compressed copy of files is served to clients that
+    accept gzip
+    """
+
+    def __call__(self):
+        self.files = get_archived_files(self.context)
+        if not self.files:
+            return self.not_found()
+
+        file_name = self.request.form.get("file")
+        if file_name:
+            return self.download_file(file_name)
+        return self.download_zip()
+
+    @property
+    def base_path(self):
+        """Returns the directory the files are relative to
+        """
+        base_path = get_archive_base_path()
+        archive_path = self.context.archive_path.strip("/")
+        return os.path.join(base_path, archive_path)
+
+    def not_found(self):
+        self.request.response.setStatus(404)
+        return ""
+
+    def accepts_gzip(self):
+        """Returns whether the client accepts gzip-encoded responses, either
+        explicitly or by a wildcard, with a quality value greater than zero
+        """
+        encoding = self.request.get_header("Accept-Encoding") or ""
+        qualities = dict(map(parse_coding, encoding.split(",")))
+        quality = qualities.get("gzip", qualities.get("*", 0))
+        return quality > 0
+
+    def download_file(self, file_name):
+        """Streams the archived file passed-in
+        """
+        file_path = os.path.normpath(os.path.join(self.base_path, file_name))
+        if file_path not in self.files:
+            # Not a file of this archived object
+            return self.not_found()
+
+        response = self.request.response
+        response.setHeader("Vary", "Accept-Encoding")
+        mime_type = mimetypes.guess_type(file_path)[0]
+        response.setHeader("Content-Type", mime_type or "text/plain")
+
+        if self.accepts_gzip():
+            gz_path = get_gzip_path(file_path)
+            if gz_path:
+                response.setHeader("Content-Encoding", "gzip")
+                return self.stream(gz_path, "gz")
+        return self.stream(file_path, "")
+
+    def download_zip(self):
+        """Streams a zip with all the archived files of the object. The zip is
+        built in a temporary file that is streamed in chunks, so the files are
+        never loaded in memory
+        """
+        # Weak validator, built from the modification times and sizes of the
+        # files, so the zip is not built when the client has it already
+        stats = map(os.stat, self.files)
+        mtime = max(map(lambda stat: stat.st_mtime, stats))
+        size = sum(map(lambda stat: stat.st_size, stats))
+        etag = '"{:x}-{:x}-{:x}-zip"'.format(int(mtime), size, len(stats))
+        if self.is_not_modified(etag):
+            return ""
+
+        tmp_file = tempfile.TemporaryFile()
+        with zipfile.ZipFile(tmp_file, "w", zipfile.ZIP_DEFLATED,
+                             allowZip64=True) as archive:
+            for file_path in self.files:
+                arcname = os.path.relpath(file_path, self.base_path)
+                archive.write(file_path, arcname)
+
+        filename = "{}.zip".format(self.context.item_id)
+        response = self.request.response
+        response.setHeader("Content-Type", "application/zip")
+        response.setHeader("Content-Disposition",
+                           "attachment; filename={}".format(filename))
+        return self.stream_file(tmp_file, etag)
+
+    def is_not_modified(self, etag):
+        """Sets the ETag header and returns whether the client has the same
+        version already, setting the Not Modified status in such case
+        """
+        response = self.request.response
+        response.setHeader("ETag", etag)
+        response.setHeader("Accept-Ranges", "bytes")
+        if_none_match = self.request.get_header("If-None-Match") or ""
+        etags = map(lambda tag: tag.strip(), if_none_match.split(","))
+        if etag in etags or "*" in etags:
+            response.setStatus(304)
+            return True
+        return False
+
+    def stream(self, file_path, variant):
+        """Streams the file passed-in with the ETag of its variant
+        """
+        stat = os.stat(file_path)
+        etag = '"{:x}-{:x}{}"'.format(int(stat.st_mtime), stat.st_size,
+                                      variant and "-" + variant or "")
+        if self.is_not_modified(etag):
+            return ""
+        return self.stream_file(open(file_path, "rb"), etag)
+
+    def stream_file(self, fileobj, etag):
+        """Returns an iterator over the file object passed-in, or over the
+        range of bytes requested, if any and the If-Range matches
+        """
+        response = self.request.response
+        fileobj.seek(0, os.SEEK_END)
+        size = fileobj.tell()
+
+        byte_range = parse_range(self.request.get_header("Range"), size)
+        if_range = self.request.get_header("If-Range")
+        if if_range and if_range != etag:
+            # The client has another version, send the whole file
+            byte_range = None
+
+        if byte_range is False:
+            fileobj.close()
+            response.setStatus(416)
+            response.setHeader("Content-Range", "bytes */{}".format(size))
+            return ""
+
+        if byte_range:
+            start, end = byte_range
+            response.setStatus(206)
+            response.setHeader("Content-Range", "bytes {}-{}/{}".format(
+                start, end, size))
+        else:
+            start, end = 0, size - 1
+
+        response.setHeader("Content-Length", str(end - start + 1))
+        if size == 0:
+            fileobj.close()
+            return ""
+        return FileStreamIterator(fileobj, start=start, end=end)
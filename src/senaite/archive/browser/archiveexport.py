@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.ARCHIVE.
+#
+# SENAITE.ARCHIVE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+
+from DateTime import DateTime
+from senaite.archive.export import EXPORT_FORMATS
+from senaite.archive.export import export
+
+from bika.lims.browser import BrowserView
+
+CONTENT_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "jsonl": "application/x-ndjson; charset=utf-8",
+}
+
+
+class ArchiveExportView(BrowserView):
+    """Streams the metadata of all archive items as CSV or JSON Lines. The
+    response is written in small blocks as the catalog is walked, so neither
+    the brains nor the output are held in memory
+    """
+
+    def __call__(self):
+        form = self.request.form
+        fmt = form.get("format", "csv")
+        if fmt not in EXPORT_FORMATS:
+            fmt = "csv"
+        year = form.get("year", "")
+        year = year.isdigit() and int(year) or None
+
+        filename = "archive-{}.{}".format(DateTime().strftime("%Y%m%d"), fmt)
+        response = self.request.response
+        response.setHeader("Content-Type", CONTENT_TYPES[fmt])
+        response.setHeader("Content-Disposition",
+                           "attachment; filename={}".format(filename))
+        # No Content-Length, so the response is sent chunked
+        export(response, fmt=fmt, year=year)
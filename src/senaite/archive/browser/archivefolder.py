@@ -21,15 +21,32 @@
 import collections
 from datetime import datetime
 from DateTime import DateTime
-from plone.memoize import view
+from plone.memoize import ram
 from senaite.archive import messageFactory as _
 from senaite.archive import permissions
+from senaite.archive.cache import LRUCache
 from senaite.archive.catalog import CATALOG_ARCHIVE
+from senaite.archive.catalog.facets import get_facet_filters
+from senaite.archive.catalog.keyset import keyset_search
+from senaite.archive.histogram import ArchiveHistogram
 from senaite.archive.utils import is_archive_valid
 from senaite.core.listing import ListingView
 
 from bika.lims import api
 from bika.lims.utils import get_link
+from bika.lims.utils import t
+
+# Cursors of the pages of the archive listing rendered by this process, keyed
+# by the listing table state and the position of the next page
+_cursors = LRUCache(maxsize=1 << 20)
+
+
+def years_cache_key(method, self):
+    """Returns the cache key for the years of archived records, that changes
+    each time the histogram of archived records changes
+    """
+    portal_path = api.get_path(api.get_portal())
+    return portal_path, ArchiveHistogram().get_counter()
 
 
 class ArchiveFolderView(ListingView):
@@ -54,14 +71,25 @@ class ArchiveFolderView(ListingView):
             "sort_order": "ascending",
         }
 
-        self.context_actions = {}
+        # Filter by the facets selected, if any
+        self.facet_filters = get_facet_filters(self.request)
+        self.contentFilter.update(self.facet_filters)
+
+        self.context_actions = {
+            _("Search in archived files"): {
+                "url": "{}/archive_search".format(api.get_url(self.context)),
+                "icon": "++resource++bika.lims.images/search_submit.png"},
+            _("Export to CSV"): {
+                "url": "{}/archive_export".format(api.get_url(self.context)),
+                "icon": "++resource++bika.lims.images/csv_icon.png"},
+        }
         if is_archive_valid():
-            self.context_actions = {
+            self.context_actions.update({
                 _("Archive old records"): {
                     "permission": permissions.AddArchiveItem,
                     "url": "{}/do_archive".format(api.get_url(self.context)),
                     "icon": "++resource++bika.lims.images/add.png"}
-            }
+            })
 
         self.columns = collections.OrderedDict((
             ("item_id", {
@@ -84,6 +112,10 @@ class ArchiveFolderView(ListingView):
                 "title": _("Path"),
                 "toggle": False,
             }),
+            ("download", {
+                "title": _("Files"),
+                "sortable": False,
+            }),
         ))
 
         self.review_states = [
@@ -102,10 +134,10 @@ class ArchiveFolderView(ListingView):
         self.request.set("disable_border", 1)
 
         # Add as many review states as years for archived records
-        for year in self.get_years_range():
+        for year, count in self.get_years_counts():
             self.review_states.append({
                 "id": str(year),
-                "title": str(year),
+                "title": "{} ({})".format(year, count),
                 "contentFilter": {"item_created": self.get_year_query(year)},
                 "columns": self.columns.keys()
             })
@@ -118,53 +150,113 @@ class ArchiveFolderView(ListingView):
             "range": "min:max",
         }
 
-    @view.memoize
-    def get_years_range(self):
-        """Returns a tuple with the range of years for which there are archived
-        records. Returns None if there are no records
+    @ram.cache(years_cache_key)
+    def get_years_counts(self):
+        """Returns a list of (year, count) tuples with the number of archived
+        records for each year. The result is cached until the histogram of
+        archived records changes
         """
-        def get_year(obj):
-            if isinstance(obj, DateTime):
-                return obj.year()
-            return obj.year
+        return ArchiveHistogram().get_years()
 
-        query = {
-            "portal_type": "ArchiveItem",
-            "sort_on": "item_created",
-            "sort_order": "ascending",
-            "sort_limit": 1,
-        }
-        brains = api.search(query, CATALOG_ARCHIVE)
-        if not brains:
+    def get_years_range(self):
+        """Returns the range of years for which there are archived records
+        """
+        years = map(lambda item: item[0], self.get_years_counts())
+        if not years:
             return []
+        return range(min(years), max(years)+1)
 
-        # Oldest year
-        min_year = get_year(brains[0].item_created)
+    def get_cursor_key(self, position):
+        """Returns the key of the cursor that points to the item right before
+        the position passed-in, for the current listing table state
+        """
+        return (api.get_path(self.context), self.review_state.get("id"),
+                self.get_sort_order(), position)
 
-        # Newest year
-        query.update({"sort_order": "descending"})
-        brains = api.search(query, CATALOG_ARCHIVE)
-        max_year = get_year(brains[0].item_created)
-        return range(min_year, max_year+1)
+    def get_cursor(self, position):
+        """Returns the cursor that points to the item right before the
+        position passed-in, if the previous page was rendered by this process
+        """
+        if not position:
+            return None
+        return _cursors.get(self.get_cursor_key(position))
 
-    @view.memoize
-    def get_archive_url(self):
-        """Returns the url of the Archive folder
+    def set_cursor(self, position, cursor):
+        """Keeps the cursor that points to the item right before the position
+        passed-in, so the page that starts at this position ("Show more") is
+        fetched right after the cursor instead of skipping all the items
         """
-        portal = api.get_portal()
-        return api.get_url(portal.archive)
+        if cursor:
+            _cursors.set(self.get_cursor_key(position), cursor)
+
+    def _fetch_brains(self, idxfrom=0):
+        """Fetch the catalog results for the current listing table state. If
+        neither a search term nor facet filters are set, the items are
+        paginated over the item_created index. The cursor of each page is
+        kept, so the next one ("Show more") is fetched right after it and its
+        cost does not depend on its depth
+        """
+        sort_on = self.get_sort_on() or self.contentFilter["sort_on"]
+        if self.get_searchterm() or self.facet_filters or \
+                sort_on != "item_created":
+            return super(ArchiveFolderView, self)._fetch_brains(idxfrom)
+
+        # Filter by year, if any
+        date_range = None
+        item_created = self.review_state.get("contentFilter", {}).get(
+            "item_created")
+        if item_created:
+            date_range = item_created["query"]
+
+        # Number of items, from the histogram of archived records
+        counts = dict(self.get_years_counts())
+        if date_range:
+            self.total = counts.get(date_range[0].year(), 0)
+        else:
+            self.total = sum(counts.values())
+
+        brains, cursor = keyset_search(
+            self.catalog, "item_created", self.pagesize,
+            cursor=self.get_cursor(idxfrom), offset=idxfrom,
+            date_range=date_range,
+            reverse=self.get_sort_order() == "descending")
+        self.set_cursor(idxfrom + len(brains), cursor)
+
+        # Tell the listing there are more items to show
+        if len(brains) == self.pagesize:
+            brains.append(None)
+        return brains
+
+    def get_item_info(self, brain):
+        """Returns the base data of the item from the brain passed-in. Archive
+        items have no workflow, and their ids and urls are resolved from the
+        path of the brain, so the archive items are never woken up
+        """
+        path = brain.getPath()
+        return {
+            "obj": brain,
+            "uid": brain.UID,
+            "url": brain.getURL(),
+            "id": path.split("/")[-1],
+            "title": brain.item_id,
+            "portal_type": brain.portal_type,
+            "review_state": "",
+            "state_title": "",
+            "state_class": "",
+        }
 
     def folderitem(self, obj, item, index):
         """Service triggered each time an item is iterated in folderitems.
         The use of this service prevents the extra-loops in child objects.
-        :obj: the instance of the class to be foldered
+        :obj: the catalog brain of the item to be foldered
         :item: dict containing the properties of the object to be used by
             the template
         :index: current index of the item
         """
-        archive_url = self.get_archive_url()
-        url = "{}/{}".format(archive_url, api.get_id(obj))
-        item["replace"]["item_id"] = get_link(url, value=obj.item_id)
+        item["replace"]["item_id"] = get_link(item["url"], value=obj.item_id)
+        download_url = "{}/archive_download".format(item["url"])
+        item["replace"]["download"] = get_link(download_url,
+                                               value=t(_("Download")))
         utime = self.ulocalized_time
         item.update({
             "item_created": utime(obj.item_created, long_format=False),
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.ARCHIVE.
+#
+# SENAITE.ARCHIVE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+
+import cgi
+import json
+import os
+from xml.etree import cElementTree as ElementTree
+
+from Products.CMFPlone.utils import safe_unicode
+from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
+from senaite.archive import logger
+from senaite.archive.cache import RenderCache
+from senaite.archive.utils import get_archive_base_path
+from senaite.archive.utils import get_archived_files
+
+from bika.lims import api
+from bika.lims.browser import BrowserView
+
+# Elements of the archived XML that are not displayed
+SKIP_ELEMENTS = ["auditlog"]
+
+
+def to_unicode(value):
+    """Returns the JSON-decoded value passed-in as unicode
+    """
+    if value is None:
+        return u""
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, sort_keys=True)
+    if isinstance(value, basestring):
+        return safe_unicode(value)
+    return unicode(value)
+
+
+def to_display_value(text):
+    """Returns the text of a field node as a displayable unicode. Field
+    values are exported as JSON
+    """
+    text = safe_unicode(text or u"")
+    try:
+        value = json.loads(text)
+    except ValueError:
+        return text
+    if isinstance(value, list):
+        return u", ".join(map(to_unicode, value))
+    return to_unicode(value)
+
+
+def parse_archived_file(file_path):
+    """Returns a list of (object_name, attributes, fields) tuples, one for each
+    object node of the archived XML file, where fields is a list of (name,
+    value) tuples. The file is parsed incrementally
+    """
+    objects = []
+    try:
+        for event, elem in ElementTree.iterparse(file_path):
+            if elem.tag in SKIP_ELEMENTS:
+                elem.clear()
+                continue
+            if elem.tag != "object":
+                continue
+            fields = []
+            for child in elem:
+                name = child.get("name")
+                if name and child.tag != "object":
+                    fields.append((name, to_display_value(child.text)))
+            attributes = dict(filter(lambda a: a[0] != "name",
+                                     elem.attrib.items()))
+            objects.append((elem.get("name"), attributes, fields))
+            elem.clear()
+    except ElementTree.ParseError as e:
+        logger.warn("Cannot parse {}: {}".format(file_path, e))
+    return objects
+
+
+def render_archived_files(files):
+    """Returns the HTML representation of the archived files passed-in
+    """
+    base_path = get_archive_base_path()
+    html = []
+    for file_path in files:
+        if not file_path.endswith(".xml"):
+            continue
+        rel_path = os.path.relpath(file_path, base_path)
+        html.append(u"<h3>{}</h3>".format(cgi.escape(safe_unicode(rel_path))))
+        for name, attributes, fields in parse_archived_file(file_path):
+            html.append(u"<table class='table table-condensed'>")
+            html.append(u"<caption>{} {}</caption>".format(
+                cgi.escape(safe_unicode(name or u"")),
+                cgi.escape(u" ".join(map(
+                    lambda a: u"{}={}".format(*a),
+                    sorted(attributes.items()))))))
+            for field_name, value in fields:
+                html.append(u"<tr><th>{}</th><td>{}</td></tr>".format(
+                    cgi.escape(safe_unicode(field_name)), cgi.escape(value)))
+            html.append(u"</table>")
+    return u"".join(html)
+
+
+class ArchiveItemView(BrowserView):
+    """Displays the archive item, together with the contents of the files the
+    object it represents was archived to. The rendered contents are cached by
+    the modification time and size of the files, so repeated views of the same
+    archive item do not read nor parse the files again
+    """
+    template = ViewPageTemplateFile("templates/archive_item.pt")
+
+    def __call__(self):
+        self.request.set("disable_border", 1)
+        return self.template()
+
+    def get_summary(self):
+        """Returns the HTML summary the archive item was created with
+        """
+        item_data = self.context.item_data
+        return item_data and item_data.output or ""
+
+    def get_download_url(self):
+        return "{}/archive_download".format(api.get_url(self.context))
+
+    def get_restore_url(self):
+        return "{}/archive_restore".format(api.get_url(self.context))
+
+    def get_archived_content(self):
+        """Returns the HTML representation of the archived files
+        """
+        files = get_archived_files(self.context)
+        if not files:
+            return u""
+        name = "{}{}".format(self.context.archive_path, self.context.item_id)
+        return RenderCache().get_or_render(name, files, render_archived_files)
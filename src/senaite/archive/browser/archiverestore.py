@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.ARCHIVE.
+#
+# SENAITE.ARCHIVE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+
+from plone.protect import CheckAuthenticator
+from senaite.archive import messageFactory as _
+from senaite.archive.restore import restore_objects
+from zExceptions import Forbidden
+
+from bika.lims import api
+from bika.lims.browser import BrowserView
+
+
+class ArchiveRestoreView(BrowserView):
+    """Restores the object represented by the archive item from the files it
+    was archived to and redirects to the restored object
+    """
+
+    def __call__(self):
+        if self.request.get("REQUEST_METHOD") != "POST":
+            raise Forbidden("Request must be POST")
+        CheckAuthenticator(self.request)
+
+        # Let the publisher commit the transaction
+        paths = restore_objects([self.context], commit=False)
+        if not paths:
+            message = _("The archived object could not be restored")
+            self.context.plone_utils.addPortalMessage(message, "error")
+            return self.request.response.redirect(api.get_url(self.context))
+
+        portal = api.get_portal()
+        obj = portal.unrestrictedTraverse(paths[0])
+        message = _("The archived object has been restored")
+        portal.plone_utils.addPortalMessage(message, "info")
+        return self.request.response.redirect(api.get_url(obj))
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.ARCHIVE.
+#
+# SENAITE.ARCHIVE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+
+import cgi
+import os
+from collections import OrderedDict
+
+from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
+from senaite.archive import logger
+from senaite.archive import messageFactory as _
+from senaite.archive.catalog import CATALOG_ARCHIVE
+from senaite.archive.fulltext import ArchiveFullText
+from senaite.archive.fulltext import DATABASE_NAME
+from senaite.archive.fulltext import HIGHLIGHT_END
+from senaite.archive.fulltext import HIGHLIGHT_START
+
+from bika.lims import api
+from bika.lims.browser import BrowserView
+
+
+class ArchiveSearchView(BrowserView):
+    """Search of archive items by the content of their archived files, from
+    the offline full-text index
+    """
+    template = ViewPageTemplateFile("templates/archive_search.pt")
+
+    def __call__(self):
+        # Don't allow any context actions
+        self.request.set("disable_border", 1)
+        self.searchterm = self.request.form.get("q", "").strip()
+        self.advanced = bool(self.request.form.get("advanced"))
+        self.results = []
+        if self.searchterm:
+            self.results = self.search(self.searchterm)
+        return self.template()
+
+    def search(self, searchterm, limit=500):
+        """Returns a list of dicts, one for each archive item with archived
+        files that match with the search term passed-in
+        """
+        fulltext = ArchiveFullText()
+        if not os.path.exists(fulltext.path):
+            self.add_status_message(
+                _("The archived files have not been indexed yet"), "warning")
+            return []
+
+        try:
+            hits = fulltext.search(searchterm, limit=limit,
+                                   advanced=self.advanced)
+        except Exception as e:
+            # Not a valid FTS5 query or no FTS5 support
+            logger.warn("Cannot search '{}' in {}: {}".format(
+                searchterm, DATABASE_NAME, e))
+            self.add_status_message(_("Not a valid search"), "error")
+            return []
+        finally:
+            fulltext.close()
+
+        # Group the files by archive item, keeping the ranking
+        files = OrderedDict()
+        for uid, file_path, snippet in hits:
+            files.setdefault(uid, []).append({
+                "path": file_path,
+                "snippet": self.to_html(snippet),
+            })
+
+        # Map the hits back to archive items with a single query
+        query = {"UID": files.keys()}
+        brains = api.search(query, CATALOG_ARCHIVE)
+        brains = dict(map(lambda brain: (brain.UID, brain), brains))
+
+        results = []
+        for uid, item_files in files.items():
+            brain = brains.get(uid)
+            if not brain:
+                # Not visible to the current user or removed
+                continue
+            results.append({
+                "url": brain.getURL(),
+                "item_id": brain.item_id,
+                "item_type": brain.item_type,
+                "files": item_files,
+            })
+        return results
+
+    def to_html(self, snippet):
+        """Returns the snippet passed-in as escaped HTML, with the matching
+        words highlighted
+        """
+        snippet = cgi.escape(snippet)
+        snippet = snippet.replace(HIGHLIGHT_START, u"<strong>")
+        return snippet.replace(HIGHLIGHT_END, u"</strong>")
+
+    def add_status_message(self, message, level="info"):
+        """Set a portal status message
+        """
+        return self.context.plone_utils.addPortalMessage(message, level)
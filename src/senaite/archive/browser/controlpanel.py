@@ -51,6 +51,18 @@ def validate_directory(path):
     return True
 
 
+def validate_policies(lines):
+    """Return true if all the lines have the format of a retention policy:
+    "portal_type|client_id|sample_type|days"
+    """
+    for line in lines or []:
+        parts = line.split(u"|")
+        if len(parts) != 4 or not parts[3].strip().isdigit():
+            raise Invalid(_("Not a valid retention policy: ${policy}",
+                            mapping={"policy": line}))
+    return True
+
+
 class IArchiveControlPanel(Interface):
     """Control panel Settings for the Archive module
     """
@@ -77,6 +89,21 @@ class IArchiveControlPanel(Interface):
         required=True,
     )
 
+    retention_policies = schema.List(
+        title=_(u"Retention policies"),
+        description=_(
+            "Retention periods in days that take precedence over the default "
+            "retention period, one per line, with the format "
+            "'portal_type|client_id|sample_type|days'. Use '*' to match any "
+            "client or sample type. Sample types are set by title. When more "
+            "than one policy applies, the most specific one is used"
+        ),
+        value_type=schema.TextLine(),
+        constraint=validate_policies,
+        default=[],
+        required=False,
+    )
+
     archive_base_path = schema.TextLine(
         title=_(u"Archive path"),
         description=_(
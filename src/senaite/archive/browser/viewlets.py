@@ -18,9 +18,14 @@
 # Copyright 2021 by it's authors.
 # Some rights reserved, see README and LICENSE.
 
+import urllib
+
 from plone.app.layout.viewlets import ViewletBase
 from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
 from senaite.archive import check_installed
+from senaite.archive.catalog.facets import FACET_PREFIX
+from senaite.archive.catalog.facets import get_facet_filters
+from senaite.archive.catalog.facets import get_facets
 from senaite.archive.utils import is_archive_valid
 
 from bika.lims import api
@@ -45,3 +50,37 @@ class ArchiveConfigurationViewlet(ViewletBase):
         authenticator = self.request.get("_authenticator")
         base_url = "{}/@@archive-controlpanel?_authenticator={}"
         return base_url.format(portal_url, authenticator)
+
+
+class ArchiveFacetsViewlet(ViewletBase):
+    """Viewlet that displays the facets the archive items can be filtered by,
+    with the number of items for each value
+    """
+    index = ViewPageTemplateFile("templates/facets_viewlet.pt")
+
+    def update(self):
+        super(ArchiveFacetsViewlet, self).update()
+        self.filters = get_facet_filters(self.request)
+        self.facets = []
+        if self.is_visible():
+            self.facets = get_facets(self.filters)
+
+    @check_installed(False)
+    def is_visible(self):
+        """Returns whether the viewlet must be visible or not
+        """
+        return self.view.__name__ == "view"
+
+    def get_facet_url(self, name, value=None):
+        """Returns the url of the archive folder filtered by the current facets
+        plus the facet and value passed-in. The facet is removed from the
+        filters if no value is given
+        """
+        filters = dict(self.filters)
+        filters[name] = value
+        params = filter(lambda item: item[1], filters.items())
+        params = map(lambda item: (FACET_PREFIX + item[0], item[1]), params)
+        url = api.get_url(self.context)
+        if not params:
+            return url
+        return "{}?{}".format(url, urllib.urlencode(sorted(params)))
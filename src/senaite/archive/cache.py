@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.ARCHIVE.
+#
+# SENAITE.ARCHIVE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from senaite.archive import logger
+from senaite.archive.utils import get_archive_base_path
+
+# Maximum size in bytes of the rendered entries kept in memory, per process
+MEMORY_SIZE = 64 << 20
+
+# Name of the directory, in the archive base path, for the on-disk tier
+CACHE_DIRECTORY = ".cache"
+
+# Name of the directory, in the cache directory, for the rendered entries
+RENDER_DIRECTORY = "html"
+
+# Maximum size in bytes of the rendered entries kept on disk
+DISK_SIZE = 1 << 30
+
+# Seconds after which the rendered entries not read are removed from disk
+DISK_MAX_AGE = 30 * 86400
+
+
+class LRUCache(object):
+    """Thread-safe in-memory cache that dismisses the least recently used
+    entries when the maximum size in bytes of the entries is reached
+    """
+
+    def __init__(self, maxsize=MEMORY_SIZE):
+        self.maxsize = maxsize
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            value = self.entries.pop(key, None)
+            if value is None:
+                return default
+            # Move to the end, as the most recently used
+            self.entries[key] = value
+            return value
+
+    def set(self, key, value):
+        size = sys.getsizeof(value)
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= sys.getsizeof(previous)
+            if size > self.maxsize:
+                # Would evict all the rest of entries
+                return
+            self.entries[key] = value
+            self.size += size
+            while self.size > self.maxsize:
+                oldest = self.entries.popitem(last=False)[1]
+                self.size -= sys.getsizeof(oldest)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+# Memory tier, shared by all the threads of the process
+_memory = LRUCache()
+
+
+def get_cache_key(name, files):
+    """Returns the cache key for the name and files passed-in. The key changes
+    whenever any of the files is modified, so stale entries are never served
+    and need no invalidation
+    """
+    if isinstance(name, unicode):
+        name = name.encode("utf-8")
+    key = hashlib.sha1(name)
+    for file_path in files:
+        stat = os.stat(file_path)
+        key.update("\n{}:{}:{}".format(file_path, stat.st_mtime, stat.st_size))
+    return key.hexdigest()
+
+
+class RenderCache(object):
+    """Two-tier cache of rendered content: a LRU in memory and a directory in
+    the archive base path, so rendered entries survive restarts and are shared
+    among processes
+    """
+
+    def __init__(self, memory=None, directory=None):
+        self.memory = memory or _memory
+        if directory is None:
+            directory = os.path.join(get_archive_base_path(), CACHE_DIRECTORY,
+                                     RENDER_DIRECTORY)
+        self.directory = directory
+
+    def get_path(self, key):
+        # Two-levels, so no directory ends up with too many files
+        return os.path.join(self.directory, key[:2], "{}.html".format(key))
+
+    def get(self, key):
+        """Returns the rendered content for the key passed-in, or None
+        """
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+
+        path = self.get_path(key)
+        try:
+            with open(path, "rb") as cached:
+                value = cached.read().decode("utf-8")
+            # Flag the entry as recently used, so it is not pruned
+            os.utime(path, None)
+        except (IOError, OSError):
+            return None
+        self.memory.set(key, value)
+        return value
+
+    def set(self, key, value):
+        """Stores the rendered content for the key passed-in in both tiers
+        """
+        self.memory.set(key, value)
+        path = self.get_path(key)
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            # Write to a temporary file and rename, so other processes never
+            # read a partially written entry
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(value.encode("utf-8"))
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            logger.warn("Cannot write cache entry {}: {}".format(path, e))
+
+    def prune(self, max_age=DISK_MAX_AGE, max_size=DISK_SIZE):
+        """Removes the entries from disk that have not been read for longer
+        than max_age seconds, as well as the least recently used ones while
+        the total size of the entries is above max_size bytes. Entries of
+        files that have been modified are never read again, so they are
+        removed eventually. Returns the number of entries removed. The whole
+        directory is walked, so this is meant to be run periodically from the
+        console (see run) rather than while serving requests
+        """
+        entries = []
+        for root, dirs, files in os.walk(self.directory):
+            for file_name in files:
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        # Least recently used first
+        entries.sort()
+        total = sum(map(lambda entry: entry[1], entries))
+        threshold = time.time() - max_age
+        removed = 0
+        for mtime, size, path in entries:
+            if mtime >= threshold and total <= max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        if removed:
+            logger.info("Removed {} entries from {}".format(
+                removed, self.directory))
+        return removed
+
+    def get_or_render(self, name, files, render):
+        """Returns the rendered content of the files passed-in from the cache,
+        or renders and stores it with the function passed-in otherwise
+        """
+        key = get_cache_key(name, files)
+        value = self.get(key)
+        if value is None:
+            value = render(files)
+            self.set(key, value)
+        return value
+
+
+def run(app, args):
+    """Removes the rendered entries from the on-disk cache of the site passed
+    in as the first argument that have not been read for longer than the days
+    passed-in next (30 by default), as well as the least recently used ones
+    while the cache is larger than the megabytes passed-in last (1024 by
+    default). Meant to be run as a zopectl command, e.g. from a cron job:
+
+        bin/instance archive_cache senaite [max_age_days] [max_size_mb]
+    """
+    from Testing.makerequest import makerequest
+    from zope.component.hooks import setSite
+
+    if not args:
+        print("Usage: archive_cache <site_id> [max_age_days] [max_size_mb]")
+        return
+
+    app = makerequest(app)
+    site = app[args[0]]
+    setSite(site)
+
+    max_age = DISK_MAX_AGE
+    if len(args) > 1:
+        max_age = int(args[1]) * 86400
+    max_size = DISK_SIZE
+    if len(args) > 2:
+        max_size = int(args[2]) << 20
+
+    removed = RenderCache().prune(max_age=max_age, max_size=max_size)
+    print("Removed {} entries from the cache".format(removed))
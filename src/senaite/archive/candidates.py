@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.ARCHIVE.
+#
+# SENAITE.ARCHIVE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+from BTrees.OOBTree import OOBTree
+from BTrees.OOBTree import OOTreeSet
+from persistent.mapping import PersistentMapping
+from senaite.archive import logger
+from senaite.archive.chunk import is_being_archived
+from senaite.archive.retention import Retention
+from senaite.archive.retention import get_retention
+from senaite.archive.utils import get_archivable_states
+from senaite.archive.utils import get_objects
+from senaite.archive.utils import get_samples_brains
+from senaite.archive.utils import get_worksheets_uids
+from senaite.archive.utils import search
+from zope.annotation.interfaces import IAnnotations
+
+from bika.lims import api
+from bika.lims.interfaces import IAnalysisRequest
+
+# Annotation key where the archive candidates are stored
+CANDIDATES_STORAGE = "senaite.archive.candidates"
+
+# Portal types that can be archived
+CANDIDATE_TYPES = ["AnalysisRequest", "Batch", "Worksheet"]
+
+# Sort key of candidates that are not subject to the retention period
+NO_RETENTION = -1.0
+
+
+class ArchiveCandidates(object):
+    """Persistent queue of the objects that are in a status from which they
+    can be archived, sorted by the date their retention period starts from.
+    The queue is kept up-to-date by event subscribers, so an archive run only
+    needs to visit the entries which retention period has expired already
+    """
+
+    def __init__(self):
+        # Neither the archive folder nor its annotations can be tested for
+        # truth: both are falsy while empty
+        archive = api.get_portal().get("archive")
+        self.annotations = {}
+        if archive is not None:
+            self.annotations = IAnnotations(archive)
+
+    @property
+    def storage(self):
+        return self.annotations.get(CANDIDATES_STORAGE)
+
+    def is_valid(self, criteria):
+        """Returns whether the queue has been initialized for the date criteria
+        passed-in
+        """
+        storage = self.storage
+        if storage is None:
+            return False
+        return storage["criteria"] == criteria
+
+    def get_key(self, obj, retention):
+        """Returns the sort key of the object (brain or object) passed-in, or
+        None if the object cannot be archived yet. Batches and worksheets are
+        archived after their samples, so they are keyed by the latest key of
+        their samples and are not candidates while any of their samples is in
+        a status from which it cannot be archived. Restored objects are not
+        candidates either
+        """
+        if api.get_uid(obj) in retention.restored:
+            return None
+
+        portal_type = api.get_portal_type(obj)
+        if portal_type == "AnalysisRequest":
+            if api.is_brain(obj):
+                return retention.get_timestamp(obj)
+            return retention.get_date(obj).timeTime()
+
+        uid = api.get_uid(obj)
+        samples = get_samples_brains([uid]).get(uid, [])
+        states = get_archivable_states("AnalysisRequest")
+        if any(map(lambda brain: brain.review_state not in states, samples)):
+            return None
+
+        keys = map(retention.get_timestamp, samples)
+        policies = map(lambda pol: pol.portal_type, retention.policies)
+        if portal_type in policies:
+            # The retention period of the object itself applies too
+            if api.is_brain(obj):
+                keys.append(retention.get_timestamp(obj))
+            else:
+                keys.append(retention.get_date(obj).timeTime())
+        return max(keys or [NO_RETENTION])
+
+    def add(self, obj, retention=None):
+        """Adds the object (brain or object) to the queue of candidates, or
+        updates its sort key if already in the queue
+        """
+        storage = self.storage
+        if storage is None:
+            return
+        retention = retention or get_retention()
+        uid = api.get_uid(obj)
+        key = self.get_key(obj, retention)
+        self.discard(uid)
+        if key is None:
+            return
+        storage["queue"].insert((key, uid))
+        storage["keys"][uid] = key
+
+    def discard(self, uid):
+        """Removes the object with the UID passed-in from the queue
+        """
+        storage = self.storage
+        if storage is None:
+            return
+        key = storage["keys"].get(uid)
+        if key is None:
+            return
+        storage["queue"].remove((key, uid))
+        del storage["keys"][uid]
+
+    def update_containers(self, sample, retention=None):
+        """Updates the sort keys of the batch and worksheets the sample
+        passed-in belongs to, so they enter the queue once all their samples
+        can be archived, or leave it otherwise
+        """
+        if self.storage is None:
+            return
+        uid = api.get_uid(sample)
+        uids = set(get_worksheets_uids([uid]).get(uid, []))
+        uids.add(sample.getField("Batch").getRaw(sample))
+        retention = retention or get_retention()
+        for container in get_objects(filter(None, uids)):
+            portal_type = api.get_portal_type(container)
+            states = get_archivable_states(portal_type)
+            if api.get_review_status(container) in states:
+                self.add(container, retention=retention)
+            else:
+                self.discard(api.get_uid(container))
+
+    def get_eligible(self, retention):
+        """Returns the UIDs of the candidates which retention period might have
+        expired, sorted by date. The most recent threshold from the retention
+        policies and the default retention period is used
+        """
+        threshold = NO_RETENTION + 1
+        if retention.max_threshold is not None:
+            threshold = retention.max_threshold.timeTime()
+        keys = self.storage["queue"].keys(max=(threshold, ""))
+        return map(lambda key: key[1], keys)
+
+    def rebuild(self):
+        """Initializes the queue with the objects from the catalogs that are
+        in a status from which they can be archived
+        """
+        logger.info("Rebuilding archive candidates ...")
+        retention = Retention()
+        self.annotations[CANDIDATES_STORAGE] = PersistentMapping({
+            "criteria": retention.criteria,
+            "queue": OOTreeSet(),
+            "keys": OOBTree(),
+        })
+        for portal_type in CANDIDATE_TYPES:
+            states = get_archivable_states(portal_type)
+            if not states:
+                continue
+            for brain in search(portal_type, review_state=states):
+                self.add(brain, retention=retention)
+        logger.info("Rebuilding archive candidates [DONE]")
+
+
+def get_candidates(chunk_size=100):
+    """Returns an enumerator with the objects which retention period has
+    expired and are in a status from which they can be archived. The objects
+    are loaded in bulk, in chunks of the given size
+    """
+    retention = Retention()
+    candidates = ArchiveCandidates()
+    if not candidates.is_valid(retention.criteria):
+        candidates.rebuild()
+
+    uids = candidates.get_eligible(retention)
+    uids = filter(lambda uid: uid not in retention.restored, uids)
+    if retention.policies:
+        # The eligibility of each candidate depends on the policy that applies
+        outside = retention.get_outside(uids)
+        uids = filter(lambda uid: uid in outside, uids)
+
+    for start in range(0, len(uids), chunk_size):
+        chunk_uids = uids[start:start+chunk_size]
+        objects = get_objects(chunk_uids)
+        if len(objects) < len(chunk_uids):
+            # Objects removed while their removal was not tracked
+            found = set(map(api.get_uid, objects))
+            for uid in filter(lambda u: u not in found, chunk_uids):
+                candidates.discard(uid)
+        for obj in objects:
+            yield obj
+
+
+def on_after_transition(obj, event):
+    """Adds the object to the queue of archive candidates when it reaches a
+    status from which can be archived, or removes it otherwise
+    """
+    if not event.transition or is_being_archived(obj):
+        return
+    candidates = ArchiveCandidates()
+    if event.transition.id == "archive":
+        candidates.discard(api.get_uid(obj))
+        return
+
+    portal_type = api.get_portal_type(obj)
+    states = get_archivable_states(portal_type)
+    if api.get_review_status(obj) in states:
+        candidates.add(obj)
+    else:
+        candidates.discard(api.get_uid(obj))
+
+    if not IAnalysisRequest.providedBy(obj):
+        return
+
+    # Batch and worksheets might be blocked by this sample, or not anymore.
+    # This only changes when the sample enters or leaves an archivable status
+    old_state = event.old_state and event.old_state.id
+    new_state = event.new_state and event.new_state.id
+    if (old_state in states) != (new_state in states):
+        candidates.update_containers(obj)
+
+
+def on_object_removed(obj, event):
+    """Removes the object from the queue of archive candidates
+    """
+    candidates = ArchiveCandidates()
+    candidates.discard(api.get_uid(obj))
+
+
+def on_object_modified(obj, event):
+    """Updates the sort key of the sample if the retention period is computed
+    based on the date of last modification
+    """
+    if not IAnalysisRequest.providedBy(obj) or is_being_archived(obj):
+        return
+    candidates = ArchiveCandidates()
+    storage = candidates.storage
+    if storage is None or api.get_uid(obj) not in storage["keys"]:
+        return
+    if storage["criteria"] == "modified":
+        # The keys of the batch and worksheets are not updated: they can only
+        # be archived once all their samples can be archived (see guards)
+        candidates.add(obj)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.ARCHIVE.
+#
+# SENAITE.ARCHIVE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+
+import collections
+
+from BTrees.IIBTree import IITreeSet
+from BTrees.IIBTree import intersection
+from plone.memoize import ram
+from senaite.archive import messageFactory as _
+from senaite.archive.catalog import CATALOG_ARCHIVE
+from senaite.archive.histogram import ArchiveHistogram
+
+from bika.lims import api
+
+# Prefix of the request parameters the facets are filtered by
+FACET_PREFIX = "facet_"
+
+# Indexes from the archive catalog the archive items can be filtered by
+FACETS = collections.OrderedDict((
+    ("item_type", _("Type")),
+    ("item_client", _("Client")),
+    ("item_sample_type", _("Sample type")),
+    ("item_review_state", _("Status")),
+))
+
+
+def get_facet_filters(request):
+    """Returns a dict with the facet filters from the request passed-in
+    """
+    filters = {}
+    for name in FACETS.keys():
+        value = request.form.get("{}{}".format(FACET_PREFIX, name))
+        if value and isinstance(value, basestring):
+            filters[name] = value
+    return filters
+
+
+def to_treeset(rids):
+    """Returns a set of record ids from the value of an index entry, that can
+    be either a single record id or a set of record ids
+    """
+    if isinstance(rids, int):
+        return IITreeSet((rids,))
+    return rids
+
+
+def get_filter_rids(catalog, filters):
+    """Returns the set of record ids that match with all the facet filters
+    passed-in, or None if no filters are given. The sets of record ids are
+    taken straight from the indexes and intersected, no brains are built
+    """
+    if not filters:
+        return None
+
+    # Start with the most selective filter, so intersections are cheaper
+    rids = None
+    sets = []
+    for name, value in filters.items():
+        index = catalog._catalog.getIndex(name)  # noqa
+        sets.append(to_treeset(index._index.get(value, IITreeSet())))  # noqa
+    for rset in sorted(sets, key=len):
+        rids = rset if rids is None else intersection(rids, rset)
+        if not rids:
+            return IITreeSet()
+    return rids
+
+
+def get_facet_counts(catalog, name, base=None):
+    """Returns a list of (value, count) tuples with the number of records
+    for each value of the index passed-in, restricted to the record ids from
+    base, if provided. Depending on which one is smaller, either the values
+    of the index are intersected with base or base is walked through the
+    reverse index of the index
+    """
+    index = catalog._catalog.getIndex(name)  # noqa
+    if base is not None and len(base) < index.indexSize():
+        counts = collections.defaultdict(int)
+        unindex = index._unindex  # noqa
+        for rid in base:
+            value = unindex.get(rid)
+            if value:
+                counts[value] += 1
+        return counts.items()
+
+    counts = []
+    for value, rids in index._index.items():  # noqa
+        rids = to_treeset(rids)
+        if base is not None:
+            rids = intersection(base, rids)
+        count = len(rids)
+        if value and count:
+            counts.append((value, count))
+    return counts
+
+
+def counts_cache_key(method, name):
+    """Returns the cache key for the unfiltered counts of a facet, that
+    changes each time the histogram of archived records changes, that is, each
+    time archive items are added or removed
+    """
+    portal_path = api.get_path(api.get_portal())
+    return portal_path, name, ArchiveHistogram().get_counter()
+
+
+@ram.cache(counts_cache_key)
+def get_unfiltered_counts(name):
+    """Returns a list of (value, count) tuples with the number of archive
+    items for each value of the index passed-in. Counting walks all the sets
+    of record ids of the index, so the result is cached until the archive
+    items change
+    """
+    catalog = api.get_tool(CATALOG_ARCHIVE)
+    return get_facet_counts(catalog, name)
+
+
+def get_facets(filters=None, limit=20):
+    """Returns a list of dicts, one for each facet, with the number of archive
+    items for each value of the facet, restricted to the filters passed-in.
+    The filter of each facet is dismissed when counting its own values, so
+    the rest of values of the facet remain selectable
+    """
+    catalog = api.get_tool(CATALOG_ARCHIVE)
+    filters = filters or {}
+    facets = []
+    for name, title in FACETS.items():
+        others = dict(filter(lambda f: f[0] != name, filters.items()))
+        base = get_filter_rids(catalog, others)
+        if base is None:
+            counts = get_unfiltered_counts(name)
+        else:
+            counts = get_facet_counts(catalog, name, base=base)
+        counts = sorted(counts, key=lambda count: (-count[1], count[0]))
+        facets.append({
+            "id": name,
+            "title": title,
+            "selected": filters.get(name),
+            "values": counts[:limit],
+        })
+    return facets
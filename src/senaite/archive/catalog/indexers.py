@@ -21,8 +21,32 @@
 from plone.indexer import indexer
 from senaite.archive.interfaces import IArchiveCatalog
 from senaite.archive.interfaces import IArchiveItem
+from senaite.archive.utils import get_last_modification_date
+
+from bika.lims.interfaces import IAnalysisRequest
+from bika.lims.interfaces import IBikaCatalogAnalysisRequestListing
 
 
 @indexer(IArchiveItem, IArchiveCatalog)
 def listing_searchable_text(instance):
     return instance.search_text
+
+
+@indexer(IAnalysisRequest, IBikaCatalogAnalysisRequestListing)
+def related_sample_uids(instance):
+    """Returns the UIDs of the samples the instance has to be archived before:
+    the sample it is a partition of, the sample it is a retest of and its
+    primary sample. The raw values of the reference fields are used, so the
+    referenced samples are not woken up
+    """
+    fields = ["ParentAnalysisRequest", "Invalidated", "PrimaryAnalysisRequest"]
+    uids = map(lambda name: instance.getField(name).getRaw(instance), fields)
+    return filter(None, uids)
+
+
+@indexer(IAnalysisRequest)
+def last_activity(instance):
+    """Returns the date of the last activity of the instance, either a
+    modification or a transition. Registered for Batches and Worksheets too
+    """
+    return get_last_modification_date(instance)
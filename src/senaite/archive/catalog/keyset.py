@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.ARCHIVE.
+#
+# SENAITE.ARCHIVE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+from bika.lims import api
+
+
+def get_rids(value):
+    """Returns a list with the record ids from the value of an index entry,
+    that can be either a single record id or a set of record ids
+    """
+    if isinstance(value, int):
+        return [value]
+    return list(value)
+
+
+def get_cursor(key, uid):
+    """Returns the cursor that points to the record with the given index key
+    and UID
+    """
+    return "{}:{}".format(key, uid)
+
+
+def parse_cursor(cursor):
+    """Returns a tuple (key, uid) from the cursor passed-in, or None
+    """
+    try:
+        key, uid = cursor.split(":", 1)
+        return int(key), uid
+    except (AttributeError, ValueError):
+        return None
+
+
+def keyset_search(catalog, index_name, size, cursor=None, offset=0,
+                  date_range=None, reverse=False, rids=None):
+    """Returns a tuple (brains, cursor) with a page of brains sorted by the
+    date index passed-in and by UID, plus the cursor pointing to the last
+    record of the page. The page starts right after the cursor, if provided,
+    or after the offset otherwise. The index tree is walked directly, so the
+    cost of a page does not depend on how deep it is when a cursor is used.
+    When an offset is used instead, all the keys before the page are still
+    walked, so the cost grows with the depth of the page, although only the
+    number of records per key is computed for the records to skip, without
+    sorting nor loading them. If a set of record ids is given, the results are
+    restricted to them, and when there are fewer records than keys in the
+    index, the records are sorted straight instead of walking the index
+    """
+    catalog = api.get_tool(catalog)
+    index = catalog._catalog.getIndex(index_name)  # noqa
+    uid_index = catalog._catalog.getIndex("UID")  # noqa
+
+    # Boundaries of the keys to walk through
+    min_key = max_key = None
+    if date_range:
+        min_key = index._convert(date_range[0])  # noqa
+        max_key = index._convert(date_range[1])  # noqa
+
+    position = parse_cursor(cursor)
+    if position:
+        offset = 0
+        if reverse:
+            max_key = position[0]
+        else:
+            min_key = position[0]
+
+    if rids is not None and len(rids) < index.indexSize():
+        return sparse_search(catalog, index, size, rids, offset=offset,
+                             position=position, min_key=min_key,
+                             max_key=max_key, reverse=reverse)
+
+    items = index._index.items(min_key, max_key)  # noqa
+    if reverse:
+        items = reversed(items)
+
+    allowed = rids
+    rids = []
+    for key, value in items:
+        # Records with the same key are sorted by UID
+        entries = get_rids(value)
+        if allowed is not None:
+            entries = filter(allowed.has_key, entries)
+        if offset >= len(entries):
+            offset -= len(entries)
+            continue
+
+        entries = map(lambda rid: (uid_index.getEntryForObject(rid), rid),
+                      entries)
+        entries = sorted(entries, reverse=reverse)
+        if position and key == position[0]:
+            if reverse:
+                entries = filter(lambda e: e[0] < position[1], entries)
+            else:
+                entries = filter(lambda e: e[0] > position[1], entries)
+
+        for uid, rid in entries[offset:]:
+            rids.append((key, uid, rid))
+            if len(rids) >= size:
+                break
+        offset = 0
+        if len(rids) >= size:
+            break
+
+    brains = map(lambda rid: catalog._catalog[rid[2]], rids)  # noqa
+    next_cursor = rids and get_cursor(*rids[-1][:2]) or None
+    return brains, next_cursor
+
+
+def sparse_search(catalog, index, size, rids, offset=0, position=None,
+                  min_key=None, max_key=None, reverse=False):
+    """Returns a tuple (brains, cursor) with a page of brains from the record
+    ids passed-in, sorted by the index and by UID. The key of each record is
+    taken from the reverse index, so only the records passed-in are visited
+    """
+    uid_index = catalog._catalog.getIndex("UID")  # noqa
+    entries = []
+    for rid in rids:
+        key = index.getEntryForObject(rid)
+        if key is None:
+            continue
+        if min_key is not None and key < min_key:
+            continue
+        if max_key is not None and key > max_key:
+            continue
+        entries.append((key, uid_index.getEntryForObject(rid), rid))
+
+    entries.sort(reverse=reverse)
+    if position:
+        if reverse:
+            entries = filter(lambda e: e[:2] < position, entries)
+        else:
+            entries = filter(lambda e: e[:2] > position, entries)
+
+    entries = entries[offset:offset + size]
+    brains = map(lambda entry: catalog._catalog[entry[2]], entries)  # noqa
+    next_cursor = entries and get_cursor(*entries[-1][:2]) or None
+    return brains, next_cursor
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.ARCHIVE.
+#
+# SENAITE.ARCHIVE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+from senaite.archive.chunk import is_being_archived
+from senaite.archive.utils import get_last_modification_date
+
+from bika.lims import api
+
+# Name of the index and metadata column with the date of the last activity
+LAST_ACTIVITY = "last_activity"
+
+
+class LastActivity(object):
+    """Holder of the last activity date, so the value is computed only once
+    for all the catalogs and the index does not need the indexer wrapper
+    """
+
+    def __init__(self, value):
+        self.last_activity = value
+
+
+def reindex_last_activity(obj, event):
+    """Updates the last activity of the object after a transition or an
+    edition, so the retention period can be resolved with a range query
+    """
+    if is_being_archived(obj):
+        # The object will be removed
+        return
+
+    transition = getattr(event, "transition", None)
+    if transition and transition.id == "archive":
+        # The object will be removed
+        return
+
+    path = api.get_path(obj)
+    record = LastActivity(get_last_modification_date(obj))
+    for catalog in api.get_catalogs_for(obj):
+        update_last_activity(catalog, path, record)
+
+
+def update_last_activity(catalog, path, record):
+    """Updates the last activity index and metadata column of the catalog
+    record for the path passed-in in place. Unlike catalog_object, neither the
+    rest of the metadata nor the indexer wrapper are computed. Does nothing if
+    the object is not catalogued yet: it will be fully indexed by core
+    """
+    _catalog = catalog._catalog  # noqa
+    rid = _catalog.uids.get(path, None)
+    if rid is None:
+        return
+
+    if LAST_ACTIVITY in _catalog.indexes:
+        _catalog.getIndex(LAST_ACTIVITY).index_object(rid, record)
+
+    position = _catalog.schema.get(LAST_ACTIVITY)
+    if position is None:
+        return
+
+    # Replace the value in the metadata tuple only if it changed
+    metadata = _catalog.data[rid]
+    if metadata[position] != record.last_activity:
+        metadata = list(metadata)
+        metadata[position] = record.last_activity
+        _catalog.data[rid] = tuple(metadata)
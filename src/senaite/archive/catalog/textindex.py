@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.ARCHIVE.
+#
+# SENAITE.ARCHIVE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+
+import re
+import string
+
+from App.class_init import InitializeClass
+from BTrees.IIBTree import IISet
+from BTrees.IIBTree import intersection
+from BTrees.IIBTree import multiunion
+from Products.CMFPlone.utils import safe_unicode
+from Products.PluginIndexes.common import safe_callable
+from Products.PluginIndexes.common.util import parseIndexRequest
+from Products.PluginIndexes.KeywordIndex.KeywordIndex import KeywordIndex
+
+# Characters stripped from the edges of each word
+PUNCTUATION = safe_unicode(string.punctuation) + u"\xb4"
+
+# Splits a word into its alphanumeric parts (e.g. W-0012 -> W, 0012)
+PARTS_RE = re.compile(r"\W+", re.UNICODE)
+
+# Upper bound for the keys that start with a given prefix
+MAX_CHAR = u"\uffff"
+
+
+def tokenize(text):
+    """Returns the set of lowercase tokens the text passed-in can be searched
+    by: each whitespace-separated word plus its alphanumeric parts, so both
+    "W-0012" and "0012" match the sample id "W-0012"
+    """
+    tokens = set()
+    for word in safe_unicode(text).lower().split():
+        word = word.strip(PUNCTUATION)
+        if not word:
+            continue
+        tokens.add(word)
+        tokens.update(filter(None, PARTS_RE.split(word)))
+    return tokens
+
+
+def parse_query(term):
+    """Returns a list of (word, is_prefix) tuples from the search term passed
+    in. Words ending with a wildcard are searched by prefix, the rest by exact
+    match. All words are searched by prefix when the whole term is wrapped in
+    wildcards, as the listing does (e.g. "*foo bar*"). Leading wildcards are
+    dismissed, cause words are also indexed by their alphanumeric parts
+    """
+    term = safe_unicode(term).lower().strip()
+    wrapped = term.startswith(u"*") and term.endswith(u"*")
+    words = []
+    for word in term.split():
+        is_prefix = wrapped or word.endswith(u"*")
+        word = word.strip(PUNCTUATION)
+        if word:
+            words.append((word, is_prefix))
+    return words
+
+
+class ArchiveTextIndex(KeywordIndex):
+    """Inverted index for the searchable text of archive items. The text is
+    split into tokens that are stored as sorted keys of the forward index, so
+    exact searches are a single key lookup and prefix searches are a range of
+    keys. Posting lists are stored as a single record id when a token belongs
+    to only one record, which is the case of most ids, and as a set of record
+    ids otherwise
+    """
+    meta_type = "ArchiveTextIndex"
+
+    query_options = ("query", )
+
+    def insertForwardIndexEntry(self, entry, documentId):
+        """Adds the record id to the posting list of the token passed-in. New
+        posting lists are stored as the record id itself instead of a set.
+        The base class turns them into sets when a second record is added
+        """
+        if self._index.get(entry, None) is None:
+            self._index[entry] = documentId
+            self._length.change(1)
+            return
+        super(ArchiveTextIndex, self).insertForwardIndexEntry(entry,
+                                                              documentId)
+
+    def removeForwardIndexEntry(self, entry, documentId):
+        """Removes the record id from the posting list of the token passed-in.
+        Posting lists left with a single record are stored as the record id
+        """
+        row = self._index.get(entry, None)
+        if isinstance(row, int):
+            if row == documentId:
+                del self._index[entry]
+                self._length.change(-1)
+            return
+
+        super(ArchiveTextIndex, self).removeForwardIndexEntry(entry,
+                                                              documentId)
+        row = self._index.get(entry, None)
+        if row is not None and len(row) == 1:
+            self._index[entry] = row.minKey()
+
+    def _get_object_keywords(self, obj, attr):
+        text = getattr(obj, attr, None)
+        if safe_callable(text):
+            try:
+                text = text()
+            except (AttributeError, TypeError):
+                return ()
+        if not text:
+            return ()
+        return tokenize(text)
+
+    def search(self, word, is_prefix=False):
+        """Returns the set of record ids that match with the word passed-in
+        """
+        if is_prefix:
+            rows = self._index.values(word, word + MAX_CHAR)
+        else:
+            row = self._index.get(word, None)
+            rows = row is not None and [row] or []
+        sets = map(lambda row: isinstance(row, int) and IISet((row,)) or row,
+                   rows)
+        return multiunion(sets)
+
+    def _apply_index(self, request, resultset=None):
+        """Returns the set of record ids that contain all the words of the
+        query, either by prefix or exact match
+        """
+        record = parseIndexRequest(request, self.id, self.query_options)
+        if record.keys is None:
+            return None
+
+        words = []
+        for term in record.keys:
+            words.extend(parse_query(term))
+        if not words:
+            return None
+
+        result = resultset
+        for word, is_prefix in words:
+            rids = self.search(word, is_prefix=is_prefix)
+            result = rids if result is None else intersection(result, rids)
+            if not result:
+                return IISet(), (self.id, )
+        return result, (self.id, )
+
+
+InitializeClass(ArchiveTextIndex)
+
+
+def manage_addArchiveTextIndex(self, id, extra=None, REQUEST=None,
+                               RESPONSE=None, URL3=None):
+    """Adds an archive text index
+    """
+    return self.manage_addIndex(id, "ArchiveTextIndex", extra=extra,
+                                REQUEST=REQUEST, RESPONSE=RESPONSE, URL1=URL3)
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.ARCHIVE.
+#
+# SENAITE.ARCHIVE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from senaite.archive import logger
+from senaite.archive.catalog import CATALOG_ARCHIVE
+from senaite.archive.histogram import ArchiveHistogram
+from senaite.archive.results import ArchiveResults
+from senaite.archive.results import get_result_rows
+from zope.component import getUtility
+from zope.component.interfaces import IFactory
+from zope.event import notify
+from zope.lifecycleevent import ObjectCreatedEvent
+
+from bika.lims import api
+from bika.lims.idserver import generateUniqueId
+from bika.lims.utils import tmpID
+
+# Holds the chunk being archived by the current thread
+_local = threading.local()
+
+
+class ArchiveChunk(object):
+    """Keeps track of the objects archived within a single transaction, so the
+    expensive operations (e.g. indexing) can be done in a single pass at the
+    end of the chunk instead of once per object
+    """
+
+    def __init__(self):
+        # Archive items created in this chunk, pending of being indexed
+        self.items = []
+        # UIDs of the objects being archived in this chunk
+        self.archiving = set()
+        # Paths of the objects uncatalogued in this chunk
+        self.uncataloged = set()
+        # UIDs of the objects planned for archival in this chunk
+        self.planned = set()
+        # Planner that resolved the objects planned for archival
+        self.planner = None
+        # Numeric results of the samples archived in this chunk
+        self.results = []
+        # Catalogs by portal type
+        self._catalogs = {}
+
+    def plan(self, objects):
+        """Resolves the dependencies of the objects passed-in and returns the
+        list of objects to archive, sorted so that each object comes after its
+        dependents. The objects from the plan are flagged as planned, so the
+        archive guards and the archival of dependents are not computed again
+        """
+        from senaite.archive.planner import ArchivePlanner
+        planner = ArchivePlanner()
+        planner.extend(objects)
+        plan = planner.plan()
+        self.planner = planner
+        self.planned.update(map(api.get_uid, plan))
+        return plan
+
+    def unplan(self, obj):
+        """Removes the objects that depend on the object passed-in from the
+        plan, so they are not archived without it. Returns the UIDs of the
+        objects removed from the plan
+        """
+        if self.planner is None:
+            return set()
+        ancestors = self.planner.get_ancestors(obj)
+        self.planned.difference_update(ancestors)
+        return ancestors
+
+    def is_planned(self, obj):
+        """Returns whether the object is planned for archival in this chunk
+        """
+        return api.get_uid(obj) in self.planned
+
+    def create_item(self, container, portal_type, **kwargs):
+        """Creates an object of the given portal type inside the container
+        without firing the add events chain. The object is neither renamed nor
+        catalogued until the chunk gets flushed
+        """
+        # get the fti
+        types_tool = api.get_tool("portal_types")
+        fti = types_tool.getTypeInfo(portal_type)
+
+        # newstyle factory, same as api.create does
+        factory = getUtility(IFactory, fti.factory)
+        obj = factory(tmpID(), **kwargs)
+        if hasattr(obj, "_setPortalTypeName"):
+            obj._setPortalTypeName(fti.getId())  # noqa
+
+        # notify that the object was created, so it gets an UID
+        notify(ObjectCreatedEvent(obj))
+
+        # Generate the final ID beforehand, so we do not need to rename the
+        # object after it has been added (with its savepoint and move events)
+        obj.id = generateUniqueId(obj.__of__(container))
+
+        # Add the object without firing ObjectWillBeAdded, ObjectAdded and
+        # ContainerModified events
+        container._setObject(obj.id, obj, suppress_events=True)  # noqa
+        obj = container._getOb(obj.id)  # noqa
+
+        # Set the initial status without reindexing workflow variables
+        wf_tool = api.get_tool("portal_workflow")
+        for workflow in wf_tool.getWorkflowsFor(obj):
+            workflow.notifyCreated(obj)
+
+        self.items.append(obj)
+        return obj
+
+    def add_results(self, obj):
+        """Keeps the numeric results of the sample passed-in, so they are
+        added to the store of archived results when the chunk gets flushed
+        """
+        self.results.extend(get_result_rows(obj))
+
+    def mark(self, objects):
+        """Flags the objects passed-in as being archived. Unlike providing a
+        marker interface, this does not modify the objects
+        """
+        self.archiving.update(map(api.get_uid, objects))
+
+    def is_archiving(self, obj):
+        """Returns whether the object is being archived in this chunk
+        """
+        return api.get_uid(obj) in self.archiving
+
+    def get_catalogs_for(self, obj):
+        """Returns the catalogs the object passed-in is catalogued in
+        """
+        portal_type = api.get_portal_type(obj)
+        catalogs = self._catalogs.get(portal_type)
+        if catalogs is None:
+            catalogs = api.get_catalogs_for(obj)
+            self._catalogs[portal_type] = catalogs
+        return catalogs
+
+    def uncatalog(self, objects):
+        """Uncatalogs the objects passed-in from all the catalogs they are
+        registered in. Paths are grouped by catalog, so each catalog removes
+        all its records in a single pass. The uncatalogued objects are not uncatalogued again by
+        the delete events fired afterwards
+        """
+        paths_by_catalog = defaultdict(list)
+        catalogs = {}
+        for obj in objects:
+            path = api.get_path(obj)
+            for catalog in self.get_catalogs_for(obj):
+                catalogs[catalog.id] = catalog
+                paths_by_catalog[catalog.id].append(path)
+            self.uncataloged.add(path)
+
+        for catalog_id, paths in paths_by_catalog.items():
+            uncatalog_paths(catalogs[catalog_id], paths)
+
+    def is_uncataloged(self, obj):
+        """Returns whether the object has been uncatalogued in this chunk
+        """
+        return api.get_path(obj) in self.uncataloged
+
+    def flush(self):
+        """Indexes all the archive items created in this chunk in one pass
+        """
+        if not self.items:
+            return
+
+        logger.info("Indexing {} archive items ...".format(len(self.items)))
+        catalog = api.get_tool(CATALOG_ARCHIVE)
+
+        # Sort by path, so the catalog assigns consecutive record ids and
+        # consecutive keys are inserted into the same BTree buckets. Since all
+        # this happens within the same transaction, each bucket is only stored
+        # once on commit, regardless of the number of items indexed
+        paths = map(api.get_path, self.items)
+        for path, item in sorted(zip(paths, self.items)):
+            catalog.catalog_object(item, path)
+
+        # Update the number of archive items by year and type
+        ArchiveHistogram().add(self.items)
+
+        # Append the results to the columnar store, one segment at a time
+        ArchiveResults().add(self.results)
+
+        self.items = []
+        self.results = []
+        logger.info("Indexing archive items [DONE]")
+
+
+def uncatalog_paths(catalog, paths):
+    """Uncatalogs the records for the paths passed-in from the catalog in a
+    single pass. Does the same as calling uncatalog_object for each path, but
+    each index removes all the records at once, sorted by record id, so the
+    buckets of its BTrees are visited consecutively instead of once per path
+    """
+    _catalog = catalog._catalog  # noqa
+    uids = _catalog.uids
+    rids = map(lambda path: uids.get(path, None), set(paths))
+    rids = sorted(filter(lambda rid: rid is not None, rids))
+    if not rids:
+        return
+
+    for name in _catalog.indexes.keys():
+        index = _catalog.getIndex(name)
+        if not hasattr(index, "unindex_object"):
+            continue
+        for rid in rids:
+            index.unindex_object(rid)
+
+    for rid in rids:
+        path = _catalog.paths[rid]
+        del _catalog.data[rid]
+        del _catalog.paths[rid]
+        del uids[path]
+    _catalog._length.change(-len(rids))  # noqa
+
+
+def get_chunk():
+    """Returns the chunk being archived in the current thread, if any
+    """
+    return getattr(_local, "chunk", None)
+
+
+def is_being_archived(obj):
+    """Returns whether the object passed-in is being archived in the current
+    thread
+    """
+    chunk = get_chunk()
+    if chunk is None:
+        return False
+    return chunk.is_archiving(obj)
+
+
+def is_planned(obj):
+    """Returns whether the object passed-in is planned for archival in the
+    current thread
+    """
+    chunk = get_chunk()
+    if chunk is None:
+        return False
+    return chunk.is_planned(obj)
+
+
+@contextmanager
+def archive_chunk():
+    """Context manager that groups the archival of objects into a chunk. The
+    chunk is flushed when the outermost context manager exits without errors
+    """
+    chunk = get_chunk()
+    if chunk is not None:
+        # Nested chunk, the outermost one takes care of the flush
+        yield chunk
+        return
+
+    chunk = ArchiveChunk()
+    _local.chunk = chunk
+    try:
+        yield chunk
+        chunk.flush()
+    finally:
+        _local.chunk = None
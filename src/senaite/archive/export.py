@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.ARCHIVE.
+#
+# SENAITE.ARCHIVE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+
+import csv
+import itertools
+import json
+import sys
+from cStringIO import StringIO
+
+from DateTime import DateTime
+from senaite.archive import logger
+from senaite.archive.catalog import CATALOG_ARCHIVE
+from senaite.archive.catalog.keyset import keyset_search
+
+from bika.lims import api
+
+# Metadata columns of the archive catalog that are exported
+EXPORT_COLUMNS = [
+    "UID",
+    "item_id",
+    "item_type",
+    "item_path",
+    "item_created",
+    "item_modified",
+    "item_client",
+    "item_sample_type",
+    "item_review_state",
+]
+
+EXPORT_FORMATS = ["csv", "jsonl"]
+
+
+def iter_brains(chunk_size=1000, year=None):
+    """Yields the brains of the archive catalog sorted by item_created, in
+    chunks walked with a cursor, so the cost of each chunk does not depend on
+    its depth. The ZODB cache is trimmed after each chunk, so the memory used
+    stays the same regardless of the number of brains
+    """
+    date_range = None
+    if year:
+        date_range = (DateTime(year, 1, 1).earliestTime(),
+                      DateTime(year, 12, 31).latestTime())
+
+    connection = api.get_portal()._p_jar  # noqa
+    cursor = None
+    while True:
+        brains, cursor = keyset_search(CATALOG_ARCHIVE, "item_created",
+                                       chunk_size, cursor=cursor,
+                                       date_range=date_range)
+        for brain in brains:
+            yield brain
+        if len(brains) < chunk_size:
+            break
+        connection.cacheGC()
+
+
+def to_value(value):
+    """Returns the value of a metadata column as a string or number
+    """
+    if isinstance(value, DateTime):
+        return value.ISO8601()
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    if value is None or not isinstance(value, (basestring, int, float)):
+        return ""
+    return value
+
+
+def to_record(brain):
+    """Returns a list with the values of the exported columns of the brain
+    """
+    return map(lambda name: to_value(getattr(brain, name, None)),
+               EXPORT_COLUMNS)
+
+
+def iter_csv(brains):
+    """Yields the brains passed-in as lines of CSV, headers first
+    """
+    output = StringIO()
+    writer = csv.writer(output)
+    rows = itertools.chain([EXPORT_COLUMNS], itertools.imap(to_record, brains))
+    for row in rows:
+        writer.writerow(row)
+        yield output.getvalue()
+        output.seek(0)
+        output.truncate()
+
+
+def iter_jsonl(brains):
+    """Yields the brains passed-in as lines of JSON objects
+    """
+    for brain in brains:
+        record = dict(zip(EXPORT_COLUMNS, to_record(brain)))
+        yield json.dumps(record, sort_keys=True) + "\n"
+
+
+def iter_export(fmt="csv", chunk_size=1000, year=None):
+    """Yields the lines of the export of the archive catalog metadata in the
+    format passed-in
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError("Format not supported: {}".format(fmt))
+    brains = iter_brains(chunk_size=chunk_size, year=year)
+    if fmt == "jsonl":
+        return iter_jsonl(brains)
+    return iter_csv(brains)
+
+
+def export(stream, fmt="csv", chunk_size=1000, year=None, buffer_size=100):
+    """Writes the archive catalog metadata into the stream passed-in, a few
+    lines at a time. Returns the number of lines written
+    """
+    num = 0
+    lines = []
+    for line in iter_export(fmt=fmt, chunk_size=chunk_size, year=year):
+        lines.append(line)
+        num += 1
+        if len(lines) >= buffer_size:
+            stream.write("".join(lines))
+            lines = []
+    if lines:
+        stream.write("".join(lines))
+    return num
+
+
+def run(app, args):
+    """Exports the archive catalog metadata of the site passed-in as the first
+    argument into the file passed-in as the second argument, or to stdout if
+    the file is "-". Meant to be run as a zopectl command:
+
+        bin/instance archive_export senaite archive.csv [csv|jsonl] [year]
+    """
+    from Testing.makerequest import makerequest
+    from zope.component.hooks import setSite
+
+    if len(args) < 2:
+        print("Usage: archive_export <site_id> <file> [csv|jsonl] [year]")
+        return
+
+    app = makerequest(app)
+    setSite(app[args[0]])
+    fmt = len(args) > 2 and args[2] or "csv"
+    year = len(args) > 3 and int(args[3]) or None
+
+    if args[1] == "-":
+        export(sys.stdout, fmt=fmt, year=year)
+        return
+
+    with open(args[1], "wb") as stream:
+        num = export(stream, fmt=fmt, year=year)
+    logger.info("Exported {} lines to {}".format(num, args[1]))
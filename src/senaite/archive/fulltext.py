@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.ARCHIVE.
+#
+# SENAITE.ARCHIVE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime
+from datetime import timedelta
+from xml.etree import cElementTree as ElementTree
+
+from DateTime import DateTime
+from Products.CMFPlone.utils import safe_unicode
+from senaite.archive import logger
+from senaite.archive.catalog import CATALOG_ARCHIVE
+from senaite.archive.utils import get_archive_base_path
+
+from bika.lims import api
+
+# Name of the sidecar database, stored in the archive base path
+DATABASE_NAME = ".fulltext.sqlite"
+
+# Markers of the matching words in the snippets of the search results
+HIGHLIGHT_START = u"\x02"
+HIGHLIGHT_END = u"\x03"
+
+# Matches the relative paths of week directories (YYYY/WW)
+WEEK_RE = re.compile(r"^(\d{4})/(\d{2})$")
+
+SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS documents USING fts5("
+    "uid UNINDEXED, file_path UNINDEXED, content, "
+    "tokenize='unicode61 remove_diacritics 1')",
+    "CREATE TABLE IF NOT EXISTS weeks (week TEXT PRIMARY KEY, indexed REAL)",
+]
+
+
+def get_week_range(year, week):
+    """Returns a tuple (first_day, last_day) of DateTime objects for the year
+    and week number passed-in, as given by strftime's %W, plus one day margin
+    at each side to make up for timezone differences
+    """
+    first = datetime.strptime("{} {} 1".format(year, week), "%Y %W %w")
+    if week == 0:
+        first = datetime(year, 1, 1)
+    first = first - timedelta(days=1)
+    last = first + timedelta(days=9)
+    return DateTime(first.isoformat()), DateTime(last.isoformat())
+
+
+def to_fts_query(text):
+    """Returns a FTS5 query that matches with the documents that contain all
+    the whitespace-separated terms of the text passed-in. Each term is quoted
+    as a string, so ids like "W-0012" are not parsed as FTS5 syntax. Terms
+    ending with a wildcard are searched by prefix
+    """
+    terms = []
+    for term in safe_unicode(text).split():
+        is_prefix = term.endswith(u"*")
+        term = term.rstrip(u"*")
+        if not term:
+            continue
+        term = u'"{}"'.format(term.replace(u'"', u'""'))
+        terms.append(is_prefix and term + u"*" or term)
+    return u" ".join(terms)
+
+
+def extract_text(file_path):
+    """Returns the text from the XML file passed-in. The file is parsed
+    incrementally and elements are dismissed once read, so the whole document
+    is never held in memory
+    """
+    texts = []
+    try:
+        for event, elem in ElementTree.iterparse(file_path):
+            if elem.text and elem.text.strip():
+                texts.append(elem.text.strip())
+            elem.clear()
+    except ElementTree.ParseError as e:
+        logger.warn("Cannot parse {}: {}".format(file_path, e))
+    return u" ".join(map(safe_unicode, texts))
+
+
+class ArchiveFullText(object):
+    """Full-text index of the archived XML files, stored in a SQLite database
+    with the FTS5 extension that lives next to the archived files. The index
+    is populated offline, one week directory at a time, and each file is
+    mapped to the ArchiveItem it belongs to
+    """
+
+    def __init__(self, base_path=None):
+        self.base_path = base_path or get_archive_base_path()
+        self.path = os.path.join(self.base_path, DATABASE_NAME)
+        self._connection = None
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path)
+            try:
+                for statement in SCHEMA:
+                    self._connection.execute(statement)
+            except sqlite3.OperationalError as e:
+                # SQLite was built without FTS5
+                self.close()
+                raise RuntimeError("Cannot setup full-text database {}: {}"
+                                   .format(self.path, e))
+        return self._connection
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def get_weeks(self):
+        """Returns the relative paths (YYYY/WW) of the week directories from
+        the archive, sorted from oldest to newest
+        """
+        weeks = []
+        for year in sorted(os.listdir(self.base_path)):
+            year_path = os.path.join(self.base_path, year)
+            if not os.path.isdir(year_path):
+                continue
+            for week in sorted(os.listdir(year_path)):
+                week = "{}/{}".format(year, week)
+                if WEEK_RE.match(week):
+                    weeks.append(week)
+        return weeks
+
+    def get_indexed(self, week):
+        """Returns the time the week directory was last indexed, or 0
+        """
+        cursor = self.connection.execute(
+            "SELECT indexed FROM weeks WHERE week = ?", (week, ))
+        row = cursor.fetchone()
+        return row and row[0] or 0
+
+    def get_item_uids(self, week):
+        """Returns a dict of original path -> UID of the archive items that
+        were archived in the week directory passed-in
+        """
+        year, week_num = map(int, WEEK_RE.match(week).groups())
+        query = {
+            "portal_type": "ArchiveItem",
+            "item_created": {
+                "query": get_week_range(year, week_num),
+                "range": "min:max",
+            },
+        }
+        # Unrestricted, cause this is meant to be run offline
+        catalog = api.get_tool(CATALOG_ARCHIVE)
+        brains = catalog.unrestrictedSearchResults(query)
+        return dict(map(lambda brain: (brain.item_path, brain.UID), brains))
+
+    def get_item_uid(self, week, file_path, items):
+        """Returns the UID of the archive item the archived file belongs to,
+        either the file of the archived object or the file of any of its
+        children. Returns None if no archive item is found
+        """
+        # YYYY/WW/<path of the original object><suffix>
+        path = os.path.splitext(file_path[len(week):])[0]
+        while path and path != "/":
+            uid = items.get(path)
+            if uid:
+                return uid
+            path = os.path.dirname(path)
+        return None
+
+    def index_week(self, week):
+        """Indexes the files of the week directory passed-in that have been
+        modified since the last time the week was indexed. Returns the number
+        of files indexed
+        """
+        started = time.time()
+        indexed = self.get_indexed(week)
+        items = None
+        num = 0
+        week_path = os.path.join(self.base_path, week)
+        for root, dirs, files in os.walk(week_path):
+            dirs.sort()
+            for file_name in sorted(files):
+                if not file_name.endswith(".xml"):
+                    # Only the XML files objects are exported to
+                    continue
+                file_path = os.path.join(root, file_name)
+                if os.path.getmtime(file_path) <= indexed:
+                    continue
+
+                if items is None:
+                    items = self.get_item_uids(week)
+
+                rel_path = os.path.relpath(file_path, self.base_path)
+                uid = self.get_item_uid(week, rel_path, items)
+                if not uid:
+                    continue
+
+                self.connection.execute(
+                    "DELETE FROM documents WHERE file_path = ?", (rel_path, ))
+                self.connection.execute(
+                    "INSERT INTO documents (uid, file_path, content) "
+                    "VALUES (?, ?, ?)",
+                    (uid, rel_path, extract_text(file_path)))
+                num += 1
+
+        self.connection.execute(
+            "INSERT OR REPLACE INTO weeks (week, indexed) VALUES (?, ?)",
+            (week, started))
+        self.connection.commit()
+        return num
+
+    def index(self, weeks=None):
+        """Indexes the files from the week directories passed-in, or from all
+        the week directories of the archive. Each week is committed at once
+        """
+        weeks = weeks or self.get_weeks()
+        total = len(weeks)
+        for num, week in enumerate(weeks):
+            count = self.index_week(week)
+            logger.info("Full-text indexing {} ({}/{}): {} files"
+                        .format(week, num + 1, total, count))
+
+    def search(self, text, limit=100, advanced=False):
+        """Returns a list of (uid, file_path, snippet) tuples with the files
+        that contain all the terms of the text passed-in, sorted by relevance.
+        The text is used as a raw FTS5 query if advanced is True. The matching
+        words of the snippet are enclosed by highlight markers
+        """
+        if not advanced:
+            text = to_fts_query(text)
+        if not text:
+            return []
+        cursor = self.connection.execute(
+            "SELECT uid, file_path, snippet(documents, 2, ?, ?, '...', 16) "
+            "FROM documents WHERE documents MATCH ? ORDER BY rank LIMIT ?",
+            (HIGHLIGHT_START, HIGHLIGHT_END, safe_unicode(text), limit))
+        return cursor.fetchall()
+
+
+def run(app, args):
+    """Indexes the archived files of the site passed-in as the first argument,
+    optionally restricted to the week directories (YYYY/WW) passed-in next.
+    Meant to be run as a zopectl command:
+
+        bin/instance archive_fulltext senaite [2021/05 2021/06 ...]
+    """
+    from Testing.makerequest import makerequest
+    from zope.component.hooks import setSite
+
+    if not args:
+        print("Usage: archive_fulltext <site_id> [YYYY/WW ...]")
+        return
+
+    app = makerequest(app)
+    site = app[args[0]]
+    setSite(site)
+
+    fulltext = ArchiveFullText()
+    try:
+        fulltext.index(weeks=args[1:])
+    finally:
+        fulltext.close()
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.ARCHIVE.
+#
+# SENAITE.ARCHIVE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+from BTrees.Length import Length
+from BTrees.OOBTree import OOBTree
+from DateTime import DateTime
+from persistent.mapping import PersistentMapping
+from senaite.archive import logger
+from senaite.archive.catalog import CATALOG_ARCHIVE
+from zope.annotation.interfaces import IAnnotations
+
+from bika.lims import api
+
+# Annotation key where the histogram of archive items is stored
+HISTOGRAM_STORAGE = "senaite.archive.histogram"
+
+
+def get_year(value):
+    """Returns the year of the date passed-in, either a DateTime or a datetime
+    """
+    if isinstance(value, DateTime):
+        return value.year()
+    return value.year
+
+
+class ArchiveHistogram(object):
+    """Persistent number of archive items by year of creation of the archived
+    object and type. The counters are Length objects, so concurrent archive
+    transactions do not conflict when updating the same counter
+    """
+
+    def __init__(self):
+        # Neither the archive folder nor its annotations can be tested for
+        # truth: both are falsy while empty
+        archive = api.get_portal().get("archive")
+        self.annotations = {}
+        if archive is not None:
+            self.annotations = IAnnotations(archive)
+
+    @property
+    def storage(self):
+        storage = self.annotations.get(HISTOGRAM_STORAGE)
+        if storage is None:
+            storage = PersistentMapping({
+                # Number of items keyed by (year, item_type)
+                "counts": OOBTree(),
+                # Increased each time the histogram changes
+                "counter": Length(),
+            })
+            self.annotations[HISTOGRAM_STORAGE] = storage
+        return storage
+
+    def get_counter(self):
+        """Returns the value of the counter that is increased each time the
+        histogram changes
+        """
+        storage = self.annotations.get(HISTOGRAM_STORAGE)
+        if storage is None:
+            return 0
+        return storage["counter"]()
+
+    def update(self, items, delta=1):
+        """Adds (or subtracts) the items passed-in to the histogram
+        """
+        if not items:
+            return
+        counts = self.storage["counts"]
+        for item in items:
+            key = (get_year(item.item_created), item.item_type)
+            length = counts.get(key)
+            if length is None:
+                length = counts[key] = Length()
+            length.change(delta)
+        self.storage["counter"].change(1)
+
+    def add(self, items):
+        """Adds the archive items passed-in to the histogram
+        """
+        self.update(items, delta=1)
+
+    def remove(self, items):
+        """Removes the archive items passed-in from the histogram
+        """
+        self.update(items, delta=-1)
+
+    def get_counts(self):
+        """Returns a dict with the number of items by (year, item_type)
+        """
+        storage = self.annotations.get(HISTOGRAM_STORAGE)
+        if storage is None:
+            return {}
+        counts = storage["counts"].items()
+        counts = map(lambda item: (item[0], item[1]()), counts)
+        return dict(filter(lambda item: item[1] > 0, counts))
+
+    def get_years(self):
+        """Returns a sorted list of (year, count) tuples with the number of
+        items for each year
+        """
+        years = {}
+        for (year, item_type), count in self.get_counts().items():
+            years[year] = years.get(year, 0) + count
+        return sorted(years.items())
+
+    def rebuild(self):
+        """Rebuilds the histogram from the metadata of the archive catalog
+        """
+        logger.info("Rebuilding archive histogram ...")
+        if HISTOGRAM_STORAGE in self.annotations:
+            del self.annotations[HISTOGRAM_STORAGE]
+        brains = api.search({"portal_type": "ArchiveItem"}, CATALOG_ARCHIVE)
+        self.add(brains)
+        logger.info("Rebuilding archive histogram [DONE]")
@@ -39,6 +39,11 @@ class IForArchiving(Interface):
     """
 
 
+class IArchiveExportContext(Interface):
+    """Marker interface for the export context used for archiving
+    """
+
+
 class IArchiveFolder(IHideActionsMenu, IDoNotSupportSnapshots):
     """Marker interface for ArchiveFolder content
     """
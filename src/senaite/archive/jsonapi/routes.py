@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.ARCHIVE.
+#
+# SENAITE.ARCHIVE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+
+import urllib
+
+from BTrees.IIBTree import intersection
+from DateTime import DateTime
+from senaite.archive.catalog import CATALOG_ARCHIVE
+from senaite.archive.catalog.facets import FACETS
+from senaite.archive.catalog.facets import get_filter_rids
+from senaite.archive.catalog.keyset import keyset_search
+from senaite.archive.results import ArchiveResults
+from senaite.archive.utils import get_summary
+from senaite.jsonapi import api as japi
+from senaite.jsonapi import request as req
+from senaite.jsonapi import url_for
+from senaite.jsonapi.v1 import add_route
+
+from bika.lims import api
+from bika.lims.api.security import check_permission
+from bika.lims.permissions import ManageBika
+
+# Fields that can be retrieved from the metadata of archive items
+METADATA_FIELDS = [
+    "UID",
+    "item_uid",
+    "item_id",
+    "item_type",
+    "item_path",
+    "item_created",
+    "item_modified",
+    "item_client",
+    "item_sample_type",
+    "item_review_state",
+]
+
+# Fields that require the archive item to be woken up
+OBJECT_FIELDS = [
+    "archive_path",
+    "summary",
+]
+
+# Fields returned when no fields are requested
+DEFAULT_FIELDS = METADATA_FIELDS + ["url"]
+
+# Parameters of the search that are kept in the url of the next page
+SEARCH_PARAMS = FACETS.keys() + ["q", "year", "fields", "limit", "sort_order"]
+
+# Maximum number of items per request
+MAX_LIMIT = 1000
+
+# Percentiles of the archived results returned when none are requested
+DEFAULT_PERCENTILES = (5, 50, 95)
+
+
+def check_access():
+    """Fails unless the current user can manage the archive
+    """
+    archive = api.get_portal().get("archive")
+    if archive is None or not check_permission(ManageBika, archive):
+        japi.fail(401, "Not allowed to access the archive")
+
+
+def get_list(data, key):
+    """Returns the value for the given key from the request data as a list.
+    Comma-separated strings are split
+    """
+    values = data.get(key) or []
+    if isinstance(values, basestring):
+        values = values.split(",")
+    values = map(lambda value: value.strip(), values)
+    return filter(None, values)
+
+
+def get_limit(data):
+    """Returns the maximum number of items to return from the request data
+    """
+    limit = data.get("limit")
+    if isinstance(limit, list):
+        limit = limit[0]
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return 50
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def get_percentiles(data):
+    """Returns the tuple of percentiles of the results to compute from the
+    request data
+    """
+    values = get_list(data, "percentiles")
+    values = filter(lambda value: api.is_floatable(value), values)
+    values = map(api.to_float, values)
+    values = filter(lambda value: 0 <= value <= 100, values)
+    values = map(lambda value: value.is_integer() and int(value) or value,
+                 values)
+    return tuple(values) or DEFAULT_PERCENTILES
+
+
+def get_fields(data):
+    """Returns the list of fields to serialize from the request data
+    """
+    fields = get_list(data, "fields")
+    if not fields:
+        return DEFAULT_FIELDS
+    allowed = METADATA_FIELDS + OBJECT_FIELDS + ["url"]
+    return filter(lambda field: field in allowed, fields)
+
+
+def to_json_value(value):
+    """Returns the value passed-in in a JSON-serializable form
+    """
+    if isinstance(value, DateTime):
+        return value.ISO8601()
+    if value is None or not isinstance(value, (basestring, int, float)):
+        return None
+    return value
+
+
+def get_item_info(brain, fields):
+    """Returns a dict with the fields passed-in of the archive item. The item
+    is only woken up if fields that are not in the catalog are requested
+    """
+    info = {}
+    for field in filter(lambda f: f in METADATA_FIELDS, fields):
+        info[field] = to_json_value(getattr(brain, field, None))
+    if "url" in fields:
+        info["url"] = brain.getURL()
+
+    object_fields = filter(lambda f: f in OBJECT_FIELDS, fields)
+    if object_fields:
+        obj = api.get_object(brain)
+        if "archive_path" in object_fields:
+            info["archive_path"] = obj.archive_path
+        if "summary" in object_fields:
+            info["summary"] = get_summary(obj)
+    return info
+
+
+def get_search_rids(catalog, data):
+    """Returns the set of record ids that match with the facet filters and
+    the search term from the request data, or None if no filters are set
+    """
+    filters = {}
+    for name in FACETS.keys():
+        value = data.get(name)
+        if isinstance(value, list):
+            value = value[0]
+        if value:
+            filters[name] = value
+    rids = get_filter_rids(catalog, filters)
+
+    term = data.get("q")
+    if isinstance(term, list):
+        term = term[0]
+    if term:
+        index = catalog._catalog.getIndex("listing_searchable_text")  # noqa
+        result = index._apply_index({"listing_searchable_text": term})
+        if result is not None:
+            matches = result[0]
+            rids = matches if rids is None else intersection(rids, matches)
+    return rids
+
+
+@add_route("/archive/search", "senaite.archive.search",
+           methods=["GET", "POST"])
+def search(context, request):
+    """Searches the archive items by facets (item_type, item_client,
+    item_sample_type, item_review_state), search term (q) and year. Items are
+    sorted by creation date of the original object and paginated with a
+    cursor. Only the requested fields are returned
+    """
+    check_access()
+    data = req.get_json()
+    catalog = api.get_tool(CATALOG_ARCHIVE)
+    limit = get_limit(data)
+    fields = get_fields(data)
+
+    cursor = data.get("cursor")
+    if isinstance(cursor, list):
+        cursor = cursor[0]
+
+    date_range = None
+    year = data.get("year")
+    if isinstance(year, list):
+        year = year[0]
+    if year and str(year).isdigit():
+        year = int(year)
+        date_range = (DateTime(year, 1, 1).earliestTime(),
+                      DateTime(year, 12, 31).latestTime())
+
+    rids = get_search_rids(catalog, data)
+    brains, next_cursor = keyset_search(
+        catalog, "item_created", limit, cursor=cursor, date_range=date_range,
+        reverse=data.get("sort_order") == "descending", rids=rids)
+
+    next_url = None
+    if len(brains) == limit and next_cursor:
+        params = dict(filter(lambda item: item[0] in SEARCH_PARAMS and
+                             isinstance(item[1], basestring), data.items()))
+        params["cursor"] = next_cursor
+        next_url = "{}?{}".format(url_for("senaite.archive.search"),
+                                  urllib.urlencode(sorted(params.items())))
+    else:
+        next_cursor = None
+
+    return {
+        "count": len(brains),
+        "cursor": next_cursor,
+        "next": next_url,
+        "items": map(lambda brain: get_item_info(brain, fields), brains),
+    }
+
+
+@add_route("/archive/items", "senaite.archive.items",
+           methods=["GET", "POST"])
+def items(context, request):
+    """Returns the archive items for the original UIDs (uids) and/or IDs (ids)
+    passed-in, in one call. Only the requested fields are returned
+    """
+    check_access()
+    data = req.get_json()
+    fields = get_fields(data)
+    uids = get_list(data, "uids")
+    ids = get_list(data, "ids")
+    if len(uids) + len(ids) > MAX_LIMIT:
+        japi.fail(400, "No more than {} items per request".format(MAX_LIMIT))
+
+    brains = []
+    if uids:
+        query = {"portal_type": "ArchiveItem", "item_uid": uids}
+        brains.extend(api.search(query, CATALOG_ARCHIVE))
+    if ids:
+        query = {"portal_type": "ArchiveItem", "item_id": ids}
+        brains.extend(api.search(query, CATALOG_ARCHIVE))
+
+    # Remove duplicates, if any
+    brains = dict(map(lambda brain: (brain.UID, brain), brains)).values()
+    brains = sorted(brains, key=lambda brain: brain.item_id)
+    return {
+        "count": len(brains),
+        "items": map(lambda brain: get_item_info(brain, fields), brains),
+    }
+
+
+@add_route("/archive/results", "senaite.archive.results",
+           methods=["GET", "POST"])
+def results(context, request):
+    """Returns the statistics (count, mean, min, max and percentiles) of the
+    numeric results of archived samples for the analysis keyword passed-in,
+    both overall and per year, or for the given year only. Returns the list of
+    keywords with archived results if no keyword is set
+    """
+    check_access()
+    data = req.get_json()
+    store = ArchiveResults()
+
+    keyword = data.get("keyword")
+    if isinstance(keyword, list):
+        keyword = keyword[0]
+    if not keyword:
+        keywords = store.get_keywords()
+        return {
+            "count": len(keywords),
+            "keywords": keywords,
+        }
+
+    percentiles = get_percentiles(data)
+    year = data.get("year")
+    if isinstance(year, list):
+        year = year[0]
+    if year and str(year).isdigit():
+        return store.get_stats(keyword, year=int(year),
+                               percentiles=percentiles)
+
+    stats = store.get_stats(keyword, percentiles=percentiles)
+    stats["years"] = store.get_yearly_stats(keyword, percentiles=percentiles)
+    return stats
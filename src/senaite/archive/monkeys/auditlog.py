@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.ARCHIVE.
+#
+# SENAITE.ARCHIVE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+from senaite.archive.chunk import is_being_archived
+
+from bika.lims.api import snapshot
+
+
+def supports_snapshots(obj):
+    """Checks if the object supports snapshots. Objects that are being archived
+    do not, so they are neither modified nor reindexed in auditlog catalog
+    right before being removed
+    """
+    if is_being_archived(obj):
+        return False
+    return snapshot.supports_snapshots(obj)
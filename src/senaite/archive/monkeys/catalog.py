@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.ARCHIVE.
+#
+# SENAITE.ARCHIVE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import copy
+
+from senaite.archive.chunk import get_chunk
+
+
+def unindexObject(self):  # noqa CamelCase
+    """Un-catalogs the object, unless it has already been un-catalogued from
+    all its catalogs while being archived
+    """
+    chunk = get_chunk()
+    if chunk and chunk.is_uncataloged(self):
+        return
+    return self._old_unindexObject()  # noqa
+
+
+def _setup_catalog(portal, catalog_id, catalog_definition):
+    """Sets up the senaite.core catalog, with the indexes and columns added by
+    senaite.archive too, so they are not removed on core setups and upgrades
+    """
+    from bika.lims.catalog import catalog_utilities
+    from senaite.archive.setuphandlers import COLUMNS
+    from senaite.archive.setuphandlers import INDEXES
+
+    definition = copy.deepcopy(catalog_definition)
+    indexes = definition.setdefault("indexes", {})
+    columns = definition.setdefault("columns", [])
+    for cat_id, name, meta_type in INDEXES:
+        if cat_id == catalog_id:
+            indexes.setdefault(name, meta_type)
+    for cat_id, name in COLUMNS:
+        if cat_id == catalog_id and name not in columns:
+            columns.append(name)
+    return catalog_utilities._old__setup_catalog(  # noqa
+        portal, catalog_id, definition)
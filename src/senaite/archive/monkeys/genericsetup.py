@@ -18,6 +18,7 @@
 # Copyright 2021 by it's authors.
 # Some rights reserved, see README and LICENSE.
 
+from senaite.archive.chunk import is_being_archived
 from senaite.archive.interfaces import IForArchiving
 
 from bika.lims import api
@@ -29,6 +30,8 @@ def can_export(obj):
     """
     if not api.is_object(obj):
         return False
+    if is_being_archived(obj):
+        return True
     if IForArchiving.providedBy(obj):
         return True
     if api.get_portal_type(obj) in SKIP_TYPES:
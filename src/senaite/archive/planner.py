@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.ARCHIVE.
+#
+# SENAITE.ARCHIVE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import heapq
+from collections import OrderedDict
+from collections import defaultdict
+
+from senaite.archive import logger
+from senaite.archive.retention import Retention
+from senaite.archive.utils import get_dependents_uids
+from senaite.archive.utils import get_objects
+from senaite.archive.utils import get_samples_brains
+from senaite.archive.utils import get_worksheets_uids
+from senaite.archive.utils import has_archive_transition
+
+from bika.lims import api
+from bika.lims.interfaces import IAnalysisRequest
+from bika.lims.interfaces import IBatch
+
+
+class ArchivePlanner(object):
+    """Builds the dependency graph of a set of objects to be archived and
+    resolves the order in which they have to be archived, so that each object
+    is archived after its dependents (e.g. retests, partitions or the samples
+    of a batch) and is visited only once. Objects that share a client, batch
+    and worksheet are kept together in the plan
+    """
+
+    def __init__(self):
+        # Objects of the graph, keyed by UID
+        self.nodes = OrderedDict()
+        # UIDs of the dependents of each node, keyed by UID
+        self.edges = {}
+        # Locality keys of the nodes, keyed by UID
+        self.keys = {}
+        # Retention settings, read once for the whole graph
+        self.retention = Retention()
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def add(self, obj):
+        """Adds the object passed-in and its dependents (recursively) to the
+        dependency graph
+        """
+        self.extend([obj])
+
+    def extend(self, objects):
+        """Adds the objects passed-in and their dependents (recursively) to the
+        dependency graph. The dependents are resolved level by level, with a
+        single catalog search for all the samples of each level
+        """
+        queue = list(objects)
+        while queue:
+            queue = filter(lambda o: api.get_uid(o) not in self.nodes, queue)
+            uids = map(api.get_uid, queue)
+            samples = filter(IAnalysisRequest.providedBy, queue)
+            dependents = get_dependents_uids(map(api.get_uid, samples))
+
+            # Samples from batches and worksheets
+            containers = filter(lambda o: not IAnalysisRequest.providedBy(o),
+                                queue)
+            brains = get_samples_brains(map(api.get_uid, containers))
+            for container_uid, samples_brains in brains.items():
+                dependents[container_uid] = map(api.get_uid, samples_brains)
+
+            next_uids = []
+            for uid, obj in zip(uids, queue):
+                dep_uids = dependents.get(uid, [])
+                self.nodes[uid] = obj
+                self.edges[uid] = dep_uids
+                next_uids.extend(dep_uids)
+
+            # Load the dependents that are not in the graph yet in bulk
+            next_uids = filter(lambda u: u not in self.nodes, next_uids)
+            queue = get_objects(list(OrderedDict.fromkeys(next_uids)))
+
+    def add_related(self):
+        """Adds the batches and worksheets the samples from the graph belong
+        to, so they are archived together with their samples
+        """
+        samples = filter(IAnalysisRequest.providedBy, self.nodes.values())
+        uids = set(map(get_batch_uid, samples))
+        samples_uids = map(api.get_uid, samples)
+        for ws_uids in get_worksheets_uids(samples_uids).values():
+            uids.update(ws_uids)
+
+        uids = filter(lambda uid: uid and uid not in self.nodes, uids)
+        self.extend(get_objects(uids))
+
+    def get_archivable(self):
+        """Returns the UIDs of the objects from the graph that can be archived,
+        regardless of whether their dependents can be archived or not
+        """
+        uids = filter(lambda uid: has_archive_transition(self.nodes[uid]),
+                      self.nodes.keys())
+
+        # Retention period is evaluated in bulk
+        return self.retention.get_outside(uids)
+
+    def get_blocked(self):
+        """Returns the UIDs of the objects from the graph that cannot be
+        archived, either because the object itself cannot be archived, because
+        any of its dependents cannot be archived or because the object is part
+        of a dependency cycle
+        """
+        archivable = self.get_archivable()
+        blocked = set(filter(lambda uid: uid not in archivable, self.nodes))
+
+        # Iterative depth-first search. Blocked status is propagated from the
+        # dependents once all them have been visited (post-order)
+        visiting, visited = set(), set()
+        for root in self.nodes.keys():
+            if root in visited:
+                continue
+            visiting.add(root)
+            stack = [(root, iter(self.edges.get(root, ())))]
+            while stack:
+                uid, dependents = stack[-1]
+                for dep in dependents:
+                    if dep in visited:
+                        continue
+                    if dep not in self.nodes:
+                        # Dependent in the catalog, but cannot be resolved
+                        logger.warn("Unresolved dependent: {}".format(dep))
+                        blocked.add(dep)
+                        visited.add(dep)
+                        continue
+                    if dep in visiting:
+                        # Dependency cycle, none of the objects can be archived
+                        path = map(lambda item: item[0], stack)
+                        cycle = path[path.index(dep):]
+                        logger.warn("Dependency cycle: {}".format(cycle))
+                        blocked.update(cycle)
+                        continue
+                    visiting.add(dep)
+                    stack.append((dep, iter(self.edges.get(dep, ()))))
+                    break
+                else:
+                    # All dependents visited
+                    stack.pop()
+                    visiting.remove(uid)
+                    visited.add(uid)
+                    dep_uids = self.edges.get(uid, ())
+                    if any(map(lambda d: d in blocked, dep_uids)):
+                        blocked.add(uid)
+        return blocked
+
+    def get_locality_keys(self):
+        """Returns a dict with the locality key of each object from the graph.
+        Samples are keyed by (client, batch, worksheet, position), while the
+        rest of objects get the highest key of their dependents, so they come
+        right after the last of them
+        """
+        samples = filter(IAnalysisRequest.providedBy, self.nodes.values())
+        worksheets = get_worksheets_uids(map(api.get_uid, samples))
+
+        keys = {}
+        for position, sample in enumerate(samples):
+            uid = api.get_uid(sample)
+            client_uid = api.get_uid(api.get_parent(sample))
+            batch_uid = get_batch_uid(sample) or ""
+            ws_uid = min(worksheets.get(uid) or [""])
+            keys[uid] = (client_uid, batch_uid, ws_uid, position)
+
+        for uid, obj in self.nodes.items():
+            if uid in keys:
+                continue
+            dep_keys = filter(None, map(keys.get, self.edges[uid]))
+            if dep_keys:
+                keys[uid] = max(dep_keys)
+            elif IBatch.providedBy(obj):
+                keys[uid] = ("", uid, "", 0)
+            else:
+                keys[uid] = ("", "", uid, 0)
+        return keys
+
+    def plan(self):
+        """Returns the list of objects from the graph that can be archived,
+        sorted so that each object comes after its dependents and objects from
+        the same client, batch and worksheet are next to each other. Objects
+        that cannot be archived, with dependents that cannot be archived or
+        that are part of a dependency cycle are excluded
+        """
+        blocked = self.get_blocked()
+        self.keys = self.get_locality_keys()
+
+        # Kahn's algorithm, with the locality key as the tie-break among the
+        # objects that are ready to be archived. Since dependents of archivable
+        # objects are archivable too, there are no cycles left
+        pending = {}
+        parents = defaultdict(list)
+        ready = []
+        for uid in self.nodes.keys():
+            if uid in blocked:
+                continue
+            dependents = set(self.edges[uid])
+            pending[uid] = len(dependents)
+            for dep in dependents:
+                parents[dep].append(uid)
+            if not dependents:
+                ready.append((self.keys[uid], uid))
+
+        heapq.heapify(ready)
+        plan = []
+        while ready:
+            key, uid = heapq.heappop(ready)
+            plan.append(self.nodes[uid])
+            for parent in parents[uid]:
+                pending[parent] -= 1
+                if not pending[parent]:
+                    heapq.heappush(ready, (self.keys[parent], parent))
+        return plan
+
+    def get_ancestors(self, obj):
+        """Returns the UIDs of the objects from the graph that depend on the
+        object passed-in, either directly or through other objects
+        """
+        parents = defaultdict(set)
+        for uid, dep_uids in self.edges.items():
+            for dep in dep_uids:
+                parents[dep].add(uid)
+
+        ancestors = set()
+        queue = [api.get_uid(obj)]
+        while queue:
+            uid = queue.pop()
+            for parent in parents[uid]:
+                if parent not in ancestors:
+                    ancestors.add(parent)
+                    queue.append(parent)
+        return ancestors
+
+    def get_cluster(self, obj):
+        """Returns the (client, batch, worksheet) cluster of the object
+        """
+        return self.keys[api.get_uid(obj)][:3]
+
+    def cut(self, plan, size):
+        """Returns the first objects from the plan passed-in, up to the size
+        given, without splitting a cluster unless the first cluster is bigger
+        than size
+        """
+        if len(plan) <= size:
+            return plan
+        cluster = self.get_cluster(plan[size])
+        for index in range(size, 0, -1):
+            if self.get_cluster(plan[index - 1]) != cluster:
+                return plan[:index]
+        return plan[:size]
+
+
+def get_batch_uid(sample):
+    """Returns the UID of the batch the sample belongs to, if any, without
+    waking up the batch
+    """
+    return sample.getField("Batch").getRaw(sample)
@@ -0,0 +1,396 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.ARCHIVE.
+#
+# SENAITE.ARCHIVE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+
+import os
+from collections import defaultdict
+from xml.dom.minidom import parseString
+from xml.etree import cElementTree as ElementTree
+
+import transaction
+from DateTime import DateTime
+from plone.dexterity.interfaces import IDexterityFTI
+from plone.uuid.interfaces import IMutableUUID
+from Products.Archetypes.ArchetypeTool import getType
+from Products.GenericSetup.context import DirectoryImportContext
+from Products.GenericSetup.interfaces import IBody
+from senaite.archive import logger
+from senaite.archive.catalog import CATALOG_ARCHIVE
+from senaite.archive.histogram import ArchiveHistogram
+from senaite.archive.restored import RestoredObjects
+from senaite.archive.results import ArchiveResults
+from senaite.archive.utils import get_archive_base_path
+from senaite.archive.utils import get_summary
+from zope.component import getUtility
+from zope.component import queryMultiAdapter
+from zope.component.interfaces import IFactory
+
+from bika.lims import api
+
+# Order in which types are restored, so the objects referenced by others
+# (e.g. the batch of a sample or the analyses of a worksheet) come first
+TYPES_ORDER = ["Batch", "AnalysisRequest", "Worksheet"]
+
+
+def read_object_node(file_path):
+    """Returns a tuple (attributes, children) with the attributes of the
+    object node of the archived XML file passed-in and the list of (id,
+    meta_type) tuples of its contained objects. The file is parsed as a stream
+    and the nodes are dismissed once read, so big files (e.g. with a long
+    audit log) are never held in memory
+    """
+    attributes = {}
+    children = []
+    depth = 0
+    events = ElementTree.iterparse(file_path, events=("start", "end"))
+    for event, elem in events:
+        if event == "start":
+            depth += 1
+            if depth == 1:
+                attributes = dict(elem.attrib)
+            elif depth == 2 and elem.tag == "object":
+                children.append((elem.get("name"), elem.get("meta_type")))
+            continue
+        depth -= 1
+        elem.clear()
+    return attributes, children
+
+
+def get_sort_key(item):
+    """Returns the key to sort the archive items to restore by
+    """
+    item_type = item.item_type
+    priority = len(TYPES_ORDER)
+    if item_type in TYPES_ORDER:
+        priority = TYPES_ORDER.index(item_type)
+    return priority, item.item_created, item.item_id
+
+
+class ArchiveRestorer(object):
+    """Restores archived objects from the files they were exported to. Objects
+    are recreated in chunks, each one committed in its own transaction. The
+    objects are added without firing events, so they are indexed only once,
+    in a single pass when all the objects of the chunk have been imported.
+    The archive items that represent them are removed afterwards
+    """
+
+    def __init__(self, chunk_size=50, commit=True):
+        portal = api.get_portal()
+        self.portal = portal
+        self.chunk_size = chunk_size
+        self.commit = commit
+        self.base_path = get_archive_base_path()
+        self.context = DirectoryImportContext(portal.portal_setup,
+                                              self.base_path)
+        # Objects restored in the current chunk, pending of being indexed
+        self.restored = []
+        # Catalogs by portal type
+        self._catalogs = {}
+
+    def restore(self, items):
+        """Restores the objects represented by the archive items passed-in.
+        Objects are only restored if their own file is imported. Restored
+        objects are flagged, so they are not archived again. Returns the list
+        of paths of the restored objects
+        """
+        items = sorted(map(api.get_object, items), key=get_sort_key)
+        total = len(items)
+        paths = []
+        for start in range(0, total, self.chunk_size):
+            chunk = items[start:start + self.chunk_size]
+            done = []
+            uids = []
+            for item in chunk:
+                savepoint = transaction.savepoint(optimistic=True)
+                restored = len(self.restored)
+                try:
+                    obj = self.restore_item(item)
+                except Exception as e:
+                    obj = None
+                    logger.error("Cannot restore {}: {}".format(
+                        item.item_path, e))
+
+                # The object itself is the first one imported
+                imported = self.restored[restored:restored + 1]
+                if obj is None or not imported or imported[0] is not obj:
+                    # Do not keep nor index partially restored objects
+                    savepoint.rollback()
+                    del self.restored[restored:]
+                    continue
+                done.append(item)
+                paths.append(api.get_path(obj))
+                uids.append(api.get_uid(obj))
+
+            self.flush()
+            self.remove_items(done)
+            RestoredObjects().add(uids)
+            if self.commit:
+                transaction.commit()
+            logger.info("Restored {}/{} archived objects".format(
+                min(start + self.chunk_size, total), total))
+        return paths
+
+    def get_relative_path(self, item):
+        """Returns the path of the directory, relative to the archive base
+        path, where the archived object was exported to
+        """
+        return "{}/".format(item.archive_path.strip("/"))
+
+    def restore_item(self, item):
+        """Recreates the object represented by the archive item passed-in and
+        its contents. Returns the restored object or None
+        """
+        container_path, obj_id = os.path.split(item.item_path)
+        container = self.portal.unrestrictedTraverse(container_path, None)
+        if container is None:
+            logger.warn("Container {} not found".format(container_path))
+            return None
+        if obj_id in container.objectIds():
+            logger.warn("Object {} exists already".format(item.item_path))
+            return None
+
+        rel_path = self.get_relative_path(item)
+        obj = self.create_slug(container, obj_id, item.item_type, rel_path)
+        if obj is not None:
+            self.import_object(obj, rel_path)
+        return obj
+
+    def construct(self, container, obj_id, portal_type):
+        """Creates an object of the given portal type inside the container
+        without firing the add events chain, so the object is neither
+        catalogued nor renamed, same as ArchiveChunk.create_item does
+        """
+        types_tool = api.get_tool("portal_types")
+        fti = types_tool.getTypeInfo(portal_type)
+        if IDexterityFTI.providedBy(fti):
+            obj = getUtility(IFactory, fti.factory)(obj_id)
+        else:
+            klass = getType(fti.content_meta_type, fti.product)["klass"]
+            obj = klass(obj_id)
+        if hasattr(obj, "_setPortalTypeName"):
+            obj._setPortalTypeName(fti.getId())  # noqa
+
+        container._setObject(obj_id, obj, suppress_events=True)  # noqa
+        obj = container._getOb(obj_id)  # noqa
+        if api.is_at_content(obj):
+            obj.initializeArchetype()
+            # avoid renaming after edit
+            obj.unmarkCreationFlag()
+
+        # Set the initial status without reindexing workflow variables
+        wf_tool = api.get_tool("portal_workflow")
+        for workflow in wf_tool.getWorkflowsFor(obj):
+            workflow.notifyCreated(obj)
+        return obj
+
+    def create_slug(self, container, obj_id, portal_type, rel_path):
+        """Creates an empty object with the id, type and UID from the archived
+        file, as well as its contained objects, recursively. Only the object
+        nodes of the files are read, with a streaming parser
+        """
+        file_path = os.path.join(self.base_path, rel_path,
+                                 "{}.xml".format(obj_id))
+        if not os.path.isfile(file_path):
+            logger.warn("File not found: {}".format(file_path))
+            return None
+
+        attributes, children = read_object_node(file_path)
+        obj = self.construct(container, obj_id, portal_type)
+        uid = attributes.get("uid")
+        if uid:
+            IMutableUUID(obj).set(uid)
+
+        types_tool = api.get_tool("portal_types")
+        child_path = "{}{}/".format(rel_path, obj_id)
+        for child_id, child_type in children:
+            if not types_tool.getTypeInfo(child_type):
+                continue
+            self.create_slug(obj, child_id, child_type, child_path)
+        return obj
+
+    def import_object(self, obj, rel_path):
+        """Imports the audit log, status and fields of the object passed-in
+        and its contents from the archived files. Unlike the structure, the
+        file of each object is read whole and parsed into a DOM, because the
+        importers of the fields work on DOM nodes. Files are exported one per
+        object, so the DOM is never bigger than a single object. The object is
+        not reindexed until the chunk is flushed
+        """
+        obj_id = api.get_id(obj)
+        importer = queryMultiAdapter((obj, self.context), IBody)
+        body = self.context.readDataFile("{}{}.xml".format(rel_path, obj_id))
+        if importer and body:
+            # Same as the importer does, but without the reindex
+            node = parseString(body).documentElement
+            importer._initAuditLog(obj, node)  # noqa
+            importer._initWorkflow(obj, node)  # noqa
+            importer._initFields(obj, node)  # noqa
+
+            # Apply the permissions of the restored status
+            wf_tool = api.get_tool("portal_workflow")
+            for workflow in wf_tool.getWorkflowsFor(obj):
+                workflow.updateRoleMappingsFor(obj)
+            self.restored.append(obj)
+
+        child_path = "{}{}/".format(rel_path, obj_id)
+        for child in obj.objectValues():
+            self.import_object(child, child_path)
+
+    def get_catalogs_for(self, obj):
+        """Returns the catalogs the object passed-in is catalogued in
+        """
+        portal_type = api.get_portal_type(obj)
+        catalogs = self._catalogs.get(portal_type)
+        if catalogs is None:
+            catalogs = api.get_catalogs_for(obj)
+            self._catalogs[portal_type] = catalogs
+        return catalogs
+
+    def flush(self):
+        """Indexes the objects restored in the current chunk, one catalog at
+        a time and sorted by path
+        """
+        if not self.restored:
+            return
+
+        logger.info("Indexing {} restored objects ...".format(
+            len(self.restored)))
+        objects_by_catalog = defaultdict(list)
+        catalogs = {}
+        for obj in self.restored:
+            for catalog in self.get_catalogs_for(obj):
+                catalogs[catalog.id] = catalog
+                objects_by_catalog[catalog.id].append(obj)
+
+        for catalog_id, objects in objects_by_catalog.items():
+            catalog = catalogs[catalog_id]
+            paths = map(api.get_path, objects)
+            for path, obj in sorted(zip(paths, objects)):
+                catalog.catalog_object(obj, path)
+
+        # Archetypes objects are registered in the UID and reference catalogs
+        # when added, but events were not fired
+        for obj in filter(api.is_at_content, self.restored):
+            obj._updateCatalog(api.get_parent(obj))  # noqa
+
+        self.restored = []
+        logger.info("Indexing restored objects [DONE]")
+
+    def remove_items(self, items):
+        """Removes the archive items passed-in, as well as their counts from
+        the histogram and their results from the store of archived results
+        """
+        if not items:
+            return
+        ArchiveHistogram().remove(items)
+        uids = filter(None, map(lambda item: item.item_uid, items))
+        if uids:
+            ArchiveResults().remove(uids)
+        archive = self.portal.archive
+        archive.manage_delObjects(map(api.get_id, items))
+
+
+def restore_objects(items, chunk_size=50, commit=True):
+    """Restores the objects represented by the archive items passed-in and
+    returns the paths of the restored objects
+    """
+    restorer = ArchiveRestorer(chunk_size=chunk_size, commit=commit)
+    return restorer.restore(items)
+
+
+def get_week_items(week):
+    """Returns the archive items of the objects archived in the directory of
+    the week (YYYY/WW) passed-in
+    """
+    from senaite.archive.fulltext import get_week_range
+    year, week_num = map(int, week.split("/"))
+    query = {
+        "portal_type": "ArchiveItem",
+        "item_created": {
+            "query": get_week_range(year, week_num),
+            "range": "min:max",
+        },
+    }
+    brains = api.search(query, CATALOG_ARCHIVE)
+    prefix = "/{}/".format(week)
+    objects = map(api.get_object, brains)
+    return filter(lambda obj: obj.archive_path.startswith(prefix), objects)
+
+
+def get_batch_items(batch_id):
+    """Returns the archive items of the batch with the id passed-in and of
+    the samples that were assigned to it
+    """
+    query = {"portal_type": "ArchiveItem", "item_id": batch_id,
+             "item_type": "Batch"}
+    batches = map(api.get_object, api.search(query, CATALOG_ARCHIVE))
+
+    # Batch ids are part of the searchable text of the samples
+    query = {"portal_type": "ArchiveItem", "item_type": "AnalysisRequest",
+             "listing_searchable_text": batch_id}
+    samples = map(api.get_object, api.search(query, CATALOG_ARCHIVE))
+    samples = filter(lambda s: get_summary(s).get("Batch") == batch_id,
+                     samples)
+    return batches + samples
+
+
+def run(app, args):
+    """Restores archived objects of the site passed-in as the first argument,
+    as the user passed-in as the second argument. Objects are selected by
+    week directory (YYYY/WW), by batch (batch:<batch_id>) or by the id of the
+    archived object. Meant to be run as a zopectl command:
+
+        bin/instance archive_restore senaite admin 2021/05 batch:B-001 W-0001
+    """
+    from AccessControl.SecurityManagement import newSecurityManager
+    from Testing.makerequest import makerequest
+    from zope.component.hooks import setSite
+
+    if len(args) < 3:
+        print("Usage: archive_restore <site_id> <user_id> "
+              "<YYYY/WW|batch:<batch_id>|item_id> ...")
+        return
+
+    app = makerequest(app)
+    site = app[args[0]]
+    setSite(site)
+    user = site.acl_users.getUser(args[1]) or app.acl_users.getUser(args[1])
+    if user is None:
+        print("User not found: {}".format(args[1]))
+        return
+    newSecurityManager(None, user)
+
+    items = []
+    for selection in args[2:]:
+        if selection.startswith("batch:"):
+            items.extend(get_batch_items(selection[len("batch:"):]))
+        elif "/" in selection:
+            items.extend(get_week_items(selection))
+        else:
+            query = {"portal_type": "ArchiveItem", "item_id": selection}
+            brains = api.search(query, CATALOG_ARCHIVE)
+            items.extend(map(api.get_object, brains))
+
+    # Remove duplicates
+    items = dict(map(lambda item: (api.get_uid(item), item), items)).values()
+    started = DateTime()
+    paths = restore_objects(items)
+    logger.info("Restored {} objects in {:.1f}s".format(
+        len(paths), (DateTime() - started) * 86400))
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.ARCHIVE.
+#
+# SENAITE.ARCHIVE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+
+from BTrees.OOBTree import OOTreeSet
+from zope.annotation.interfaces import IAnnotations
+
+from bika.lims import api
+
+# Annotation key where the UIDs of the restored objects are stored
+RESTORED_STORAGE = "senaite.archive.restored"
+
+
+class RestoredObjects(object):
+    """Persistent set of the UIDs of the objects restored from the archive.
+    Restored objects are usually beyond the retention period already, so they
+    are kept out of the archival, otherwise they would be archived again on
+    next run
+    """
+
+    def __init__(self):
+        # Neither the archive folder nor its annotations can be tested for
+        # truth: both are falsy while empty
+        archive = api.get_portal().get("archive")
+        self.annotations = {}
+        if archive is not None:
+            self.annotations = IAnnotations(archive)
+
+    def get_uids(self):
+        """Returns the set of UIDs of the restored objects. Nothing is written
+        """
+        return self.annotations.get(RESTORED_STORAGE, frozenset())
+
+    def add(self, uids):
+        """Flags the objects with the UIDs passed-in as restored
+        """
+        if not uids:
+            return
+        storage = self.annotations.get(RESTORED_STORAGE)
+        if storage is None:
+            storage = OOTreeSet()
+            self.annotations[RESTORED_STORAGE] = storage
+        storage.update(uids)
+
+    def __contains__(self, uid):
+        return uid in self.get_uids()
+
+
+def is_restored(obj):
+    """Returns whether the object passed-in was restored from the archive
+    """
+    return api.get_uid(obj) in RestoredObjects()
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.ARCHIVE.
+#
+# SENAITE.ARCHIVE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+
+import math
+from array import array
+
+from BTrees.IOBTree import IOBTree
+from BTrees.Length import Length
+from BTrees.OIBTree import OIBTree
+from BTrees.OOBTree import OOBTree
+from persistent import Persistent
+from persistent.mapping import PersistentMapping
+from senaite.archive import logger
+from zope.annotation.interfaces import IAnnotations
+
+from bika.lims import api
+from bika.lims.interfaces import IAnalysisRequest
+
+try:
+    import numpy
+except ImportError:
+    # numpy is not installed
+    numpy = None
+
+# Annotation key where the archived results are stored
+RESULTS_STORAGE = "senaite.archive.results"
+
+# Annotation key where the codes of the samples with archived results and the
+# keys of the segments with results of each sample are stored
+SAMPLES_STORAGE = "senaite.archive.results.samples"
+
+# Maximum number of results per segment. Segments are stored as a whole on
+# each commit, so they are kept small enough to make appends cheap
+SEGMENT_SIZE = 2000
+
+# States of the analyses whose results are not archived
+SKIP_STATES = ["retracted", "rejected", "cancelled"]
+
+
+class ResultsSegment(Persistent):
+    """Columns of the results of an analysis keyword for a given year. Dates
+    and results are stored as arrays of doubles, samples as an array of the
+    integer codes of their UIDs and units are dictionary encoded, so a segment
+    is stored compact and its columns can be read by numpy without copying
+    """
+
+    def __init__(self):
+        self.samples = array("I")
+        self.dates = array("d")
+        self.values = array("d")
+        self.units = []
+        self.unit_codes = array("H")
+
+    def __len__(self):
+        return len(self.values)
+
+    def append(self, code, date, value, unit):
+        if unit not in self.units:
+            self.units.append(unit)
+        self.samples.append(code)
+        self.dates.append(date)
+        self.values.append(value)
+        self.unit_codes.append(self.units.index(unit))
+        # arrays are not persistence-aware
+        self._p_changed = True
+
+    def remove(self, codes):
+        """Removes the results of the samples with the codes passed-in.
+        Returns the number of results removed
+        """
+        keep = map(lambda code: code not in codes, self.samples)
+        removed = keep.count(False)
+        if not removed:
+            return 0
+        self.samples = array("I", [c for c, k in zip(self.samples, keep) if k])
+        self.dates = array("d", [d for d, k in zip(self.dates, keep) if k])
+        self.values = array("d", [v for v, k in zip(self.values, keep) if k])
+        self.unit_codes = array(
+            "H", [c for c, k in zip(self.unit_codes, keep) if k])
+        self._p_changed = True
+        return removed
+
+
+def get_result_rows(obj):
+    """Returns a list of (keyword, uid, date, value, unit) tuples with the
+    numeric results of the valid analyses of the sample passed-in. Returns an
+    empty list if the object is not a sample
+    """
+    if not IAnalysisRequest.providedBy(obj):
+        return []
+
+    rows = []
+    uid = api.get_uid(obj)
+    for analysis in obj.getAnalyses(full_objects=True):
+        if api.get_review_status(analysis) in SKIP_STATES:
+            continue
+        result = analysis.getResult()
+        if not api.is_floatable(result):
+            continue
+        date = analysis.getResultCaptureDate() or \
+            api.get_creation_date(analysis)
+        rows.append((analysis.getKeyword(), uid, date,
+                     api.to_float(result), analysis.getUnit() or ""))
+    return rows
+
+
+def percentile(values, q):
+    """Returns the q-th percentile of the sorted list of values passed-in,
+    with linear interpolation, as numpy.percentile does
+    """
+    if not values:
+        return None
+    pos = (len(values) - 1) * q / 100.0
+    low = int(math.floor(pos))
+    high = int(math.ceil(pos))
+    return values[low] + (values[high] - values[low]) * (pos - low)
+
+
+class ArchiveResults(object):
+    """Persistent store of the numeric results of archived samples, organized
+    in columnar segments by analysis keyword and year, so historic trends can
+    be computed without restoring the archived samples
+    """
+
+    def __init__(self):
+        # Neither the archive folder nor its annotations can be tested for
+        # truth: both are falsy while empty
+        archive = api.get_portal().get("archive")
+        self.annotations = {}
+        if archive is not None:
+            self.annotations = IAnnotations(archive)
+
+    @property
+    def storage(self):
+        """Returns the segments of results, that are created the first time.
+        Only meant for writing, read with get_segments instead
+        """
+        storage = self.annotations.get(RESULTS_STORAGE)
+        if storage is None:
+            # Segments keyed by (keyword, year, segment number)
+            storage = OOBTree()
+            self.annotations[RESULTS_STORAGE] = storage
+        return storage
+
+    def get_segments(self):
+        """Returns the segments of results, or an empty mapping if no results
+        have been stored yet. Nothing is written
+        """
+        return self.annotations.get(RESULTS_STORAGE, {})
+
+    @property
+    def samples(self):
+        samples = self.annotations.get(SAMPLES_STORAGE)
+        if samples is None:
+            samples = PersistentMapping({
+                # Integer codes of the samples, keyed by UID
+                "codes": OIBTree(),
+                # Keys of the segments with results of each sample, by code
+                "segments": IOBTree(),
+                # Next code to assign
+                "next": Length(),
+            })
+            self.annotations[SAMPLES_STORAGE] = samples
+        return samples
+
+    def get_code(self, uid):
+        """Returns the integer code of the sample UID passed-in, that is
+        assigned the first time
+        """
+        samples = self.samples
+        code = samples["codes"].get(uid)
+        if code is None:
+            code = samples["next"]()
+            samples["next"].change(1)
+            samples["codes"][uid] = code
+        return code
+
+    def add(self, rows):
+        """Appends the (keyword, uid, date, value, unit) rows passed-in to the
+        last segment of their keyword and year
+        """
+        storage = self.storage
+        segments = {}
+        for keyword, uid, date, value, unit in sorted(rows):
+            year = date.year()
+            keys = self.get_keys(keyword, year)
+            key = keys and keys[-1] or None
+            if key is None or len(storage[key]) >= SEGMENT_SIZE:
+                number = key and key[2] + 1 or 0
+                key = (keyword, year, number)
+                storage[key] = ResultsSegment()
+            code = self.get_code(uid)
+            storage[key].append(code, date.timeTime(), value, unit)
+            segments.setdefault(code, set()).add(key)
+
+        # Keep track of the segments each sample has results in
+        index = self.samples["segments"]
+        for code, keys in segments.items():
+            keys.update(index.get(code, ()))
+            index[code] = tuple(sorted(keys))
+
+    def remove(self, uids):
+        """Removes the results of the samples passed-in. Only the segments
+        with results of these samples are visited
+        """
+        samples = self.annotations.get(SAMPLES_STORAGE)
+        if samples is None:
+            return
+        codes = set()
+        keys = set()
+        for uid in uids:
+            code = samples["codes"].get(uid)
+            if code is None:
+                continue
+            codes.add(code)
+            keys.update(samples["segments"].get(code, ()))
+            samples["segments"].pop(code, None)
+            del samples["codes"][uid]
+
+        removed = 0
+        storage = self.get_segments()
+        for key in keys:
+            segment = storage.get(key)
+            if segment is not None:
+                removed += segment.remove(codes)
+        logger.info("Removed {} archived results".format(removed))
+
+    def get_keys(self, keyword, year=None):
+        """Returns the keys of the segments for the given keyword and year
+        """
+        storage = self.annotations.get(RESULTS_STORAGE)
+        if storage is None:
+            return []
+        if year is None:
+            return list(storage.keys((keyword, ), (keyword, 9999)))
+        return list(storage.keys((keyword, year), (keyword, year, 99999999)))
+
+    def get_keywords(self):
+        """Returns the sorted list of keywords with archived results
+        """
+        storage = self.annotations.get(RESULTS_STORAGE)
+        if storage is None:
+            return []
+        return sorted(set(map(lambda key: key[0], storage.keys())))
+
+    def get_years(self, keyword):
+        """Returns the sorted list of years with results for the keyword
+        """
+        return sorted(set(map(lambda key: key[1], self.get_keys(keyword))))
+
+    def get_values(self, keyword, year=None):
+        """Returns the results of the keyword and year passed-in, either as a
+        numpy array or as a list if numpy is not installed
+        """
+        storage = self.get_segments()
+        segments = map(storage.get, self.get_keys(keyword, year=year))
+        if numpy is not None:
+            columns = map(lambda segment: numpy.frombuffer(
+                segment.values, dtype=numpy.float64), segments)
+            if not columns:
+                return numpy.array([], dtype=numpy.float64)
+            return numpy.concatenate(columns)
+        values = []
+        for segment in segments:
+            values.extend(segment.values)
+        return values
+
+    def get_stats(self, keyword, year=None, percentiles=(5, 50, 95)):
+        """Returns a dict with the count, mean, min, max and percentiles of the
+        results of the keyword and year passed-in
+        """
+        values = self.get_values(keyword, year=year)
+        stats = {
+            "keyword": keyword,
+            "year": year,
+            "count": len(values),
+        }
+        if not len(values):
+            return stats
+
+        if numpy is not None:
+            stats.update({
+                "mean": float(values.mean()),
+                "min": float(values.min()),
+                "max": float(values.max()),
+                "percentiles": dict(zip(percentiles, map(
+                    float, numpy.percentile(values, percentiles)))),
+            })
+            return stats
+
+        values = sorted(values)
+        stats.update({
+            "mean": math.fsum(values) / len(values),
+            "min": values[0],
+            "max": values[-1],
+            "percentiles": dict(map(
+                lambda q: (q, percentile(values, q)), percentiles)),
+        })
+        return stats
+
+    def get_yearly_stats(self, keyword, percentiles=(5, 50, 95)):
+        """Returns a list with the stats of the keyword passed-in per year
+        """
+        years = self.get_years(keyword)
+        return map(lambda year: self.get_stats(
+            keyword, year=year, percentiles=percentiles), years)
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.ARCHIVE.
+#
+# SENAITE.ARCHIVE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+from array import array
+from collections import defaultdict
+from datetime import datetime
+from itertools import compress
+
+from BTrees.IIBTree import IITreeSet
+from BTrees.IIBTree import difference
+from BTrees.IIBTree import union
+from DateTime import DateTime
+from Products.Archetypes.config import UID_CATALOG
+from senaite.archive import logger
+from senaite.archive.restored import RestoredObjects
+from senaite.archive.utils import check_indexes
+from senaite.archive.utils import get_archivable_states
+from senaite.archive.utils import get_catalog_for
+from senaite.archive.utils import get_last_modification_date
+from senaite.archive.utils import get_retention_date_criteria
+from senaite.archive.utils import get_retention_period
+from senaite.archive.utils import get_retention_policies
+from zope.annotation.interfaces import IAnnotations
+
+from bika.lims import api
+from bika.lims.catalog import SETUP_CATALOG
+
+try:
+    import numpy
+except ImportError:
+    # numpy is not installed
+    numpy = None
+
+# Wildcard for the keys of retention policies
+ANY = "*"
+
+# Request annotation key where the retention settings are kept
+RETENTION_STORAGE = "senaite.archive.retention"
+
+
+class RetentionPolicy(object):
+    """Retention period in days for the objects of a given portal type, client
+    and sample type
+    """
+
+    def __init__(self, portal_type, client_id, sample_type_uid, days):
+        self.portal_type = portal_type
+        self.client_id = client_id
+        self.sample_type_uid = sample_type_uid
+        self.days = days
+
+    @property
+    def specificity(self):
+        """Returns the number of keys of the policy that are not wildcards
+        """
+        keys = [self.portal_type, self.client_id, self.sample_type_uid]
+        return len(filter(lambda key: key != ANY, keys))
+
+    def get_query(self):
+        """Returns the catalog query that matches with the objects the policy
+        applies to, regardless of their date
+        """
+        query = {"portal_type": self.portal_type}
+        if self.client_id != ANY:
+            query["getClientID"] = self.client_id
+        if self.sample_type_uid != ANY:
+            query["getSampleTypeUID"] = self.sample_type_uid
+        return query
+
+    def applies_to(self, obj):
+        """Returns whether the policy applies to the object passed-in
+        """
+        if api.get_portal_type(obj) != self.portal_type:
+            return False
+        if self.client_id != ANY and obj.getClientID() != self.client_id:
+            return False
+        sample_type = self.sample_type_uid
+        if sample_type != ANY and obj.getSampleTypeUID() != sample_type:
+            return False
+        return True
+
+
+def parse_policy(line):
+    """Returns a RetentionPolicy from the line passed-in, with the format
+    "portal_type|client_id|sample_type|days". Sample type can be either the
+    title or the UID of the sample type. Returns None if the line is not valid
+    """
+    parts = map(lambda part: part.strip(), line.split("|"))
+    if len(parts) != 4 or not parts[0] or parts[0] == ANY:
+        return None
+
+    portal_type, client_id, sample_type, days = parts
+    if not days.isdigit():
+        return None
+
+    if portal_type != "AnalysisRequest" and (client_id, sample_type) != (ANY, ANY):
+        # Only samples can be filtered by client and sample type
+        return None
+
+    if sample_type != ANY and not api.is_uid(sample_type):
+        query = {"portal_type": "SampleType", "title": sample_type}
+        brains = api.search(query, SETUP_CATALOG)
+        if len(brains) != 1:
+            return None
+        sample_type = api.get_uid(brains[0])
+
+    return RetentionPolicy(portal_type, client_id or ANY, sample_type or ANY,
+                           int(days))
+
+
+def get_policies():
+    """Returns the retention policies set in the configuration panel, sorted
+    from the most specific to the least specific. Policies with the same
+    specificity keep the order they were set in
+    """
+    policies = []
+    for line in get_retention_policies() or []:
+        policy = parse_policy(line)
+        if policy is None:
+            logger.warn("Not a valid retention policy: {}".format(line))
+            continue
+        policies.append(policy)
+    return sorted(policies, key=lambda pol: pol.specificity, reverse=True)
+
+
+class Retention(object):
+    """Evaluates the retention period set in the configuration panel. The
+    settings are read once, on initialization, so a single instance can be
+    used to evaluate a whole run of objects
+    """
+
+    def __init__(self):
+        self.period = get_retention_period()
+        self.criteria = get_retention_date_criteria()
+        self.policies = get_policies()
+
+        # Restored objects are never outside the retention period
+        self.restored = RestoredObjects().get_uids()
+
+        # Objects dated before the threshold are outside the retention period
+        self.threshold = None
+        if self.period is not None:
+            year = datetime.now().year - self.period + 1
+            self.threshold = DateTime("{}/01/01".format(year))
+
+        # Thresholds of the policies, with day precision
+        today = DateTime().earliestTime()
+        self.thresholds = map(lambda pol: today - pol.days, self.policies)
+
+    @property
+    def index(self):
+        """Returns the name of the index and metadata column with the date to
+        compare against the threshold
+        """
+        if self.criteria == "modified":
+            return "last_activity"
+        return "created"
+
+    @property
+    def max_threshold(self):
+        """Returns the most recent threshold from both the policies and the
+        retention period, or None if no retention period is set
+        """
+        thresholds = filter(None, self.thresholds + [self.threshold])
+        return thresholds and max(thresholds) or None
+
+    def get_date(self, obj):
+        """Returns the date of the object to compare against the threshold
+        """
+        if self.criteria == "modified":
+            return get_last_modification_date(obj)
+        return api.get_creation_date(obj)
+
+    def get_timestamp(self, brain):
+        """Returns the timestamp of the date to compare against the threshold
+        from the brain passed-in. Falls back to the object if the metadata
+        column is not populated
+        """
+        date = getattr(brain, self.index, None)
+        if not date:
+            date = self.get_date(api.get_object(brain))
+        return date.timeTime()
+
+    def is_outside(self, obj):
+        """Returns whether the object is outside the retention period
+        """
+        if api.get_uid(obj) in self.restored:
+            return False
+
+        for policy, threshold in zip(self.policies, self.thresholds):
+            if policy.applies_to(obj):
+                return self.get_date(obj) < threshold
+
+        if api.get_portal_type(obj) != "AnalysisRequest":
+            # Only samples are retained by default
+            return True
+
+        if self.threshold is None:
+            # If no retention period is set, retain the object
+            return False
+        return self.get_date(obj) < self.threshold
+
+    def filter(self, brains):
+        """Returns the UIDs of the brains passed-in that are outside the
+        retention period. The dates are read from the metadata columns into a
+        compact array and compared against the threshold at once
+        """
+        if self.threshold is None or not brains:
+            return []
+
+        uids = map(api.get_uid, brains)
+        timestamps = array("d", map(self.get_timestamp, brains))
+        threshold = self.threshold.timeTime()
+        if numpy is not None:
+            values = numpy.frombuffer(timestamps, dtype=numpy.float64)
+            return map(uids.__getitem__, numpy.flatnonzero(values < threshold))
+        return list(compress(uids, map(threshold.__gt__, timestamps)))
+
+    def get_outside(self, uids):
+        """Returns the UIDs from the list passed-in that are outside of the
+        retention period. If there are retention policies, each policy is
+        resolved with a single catalog range query, and the objects matched by
+        a more specific policy are excluded with set operations on the record
+        ids, so no object is evaluated individually
+        """
+        uids = filter(lambda uid: uid and uid not in self.restored, uids)
+        if not uids:
+            return set()
+
+        # Group the UIDs by portal type
+        uids_by_type = defaultdict(list)
+        for brain in api.search({"UID": uids}, UID_CATALOG):
+            uids_by_type[brain.portal_type].append(api.get_uid(brain))
+
+        outside = set()
+        for portal_type, type_uids in uids_by_type.items():
+            catalog = api.get_tool(get_catalog_for(portal_type))
+            policies = filter(lambda pol: pol[0].portal_type == portal_type,
+                              zip(self.policies, self.thresholds))
+
+            if portal_type == "AnalysisRequest" and not policies:
+                # Retention period only, compare the metadata at once
+                brains = catalog({"UID": type_uids})
+                outside.update(self.filter(brains))
+                continue
+
+            # Matches of the policies and the default retention
+            rules = map(lambda pol: (pol[0].get_query(), pol[1]), policies)
+            if portal_type == "AnalysisRequest" and self.threshold:
+                rules.append(({"portal_type": portal_type}, self.threshold))
+            elif portal_type != "AnalysisRequest":
+                # Objects without a policy are not retained
+                rules.append(({"portal_type": portal_type}, None))
+
+            # Only objects in a status from which they can be archived
+            states = get_archivable_states(portal_type)
+            base = {"UID": type_uids, "review_state": states}
+
+            rids = IITreeSet()
+            previous = []
+            for query, threshold in rules:
+                query = dict(query, **base)
+                date_query = {}
+                if threshold:
+                    date_query = {self.index: {
+                        "query": threshold - 1.0 / 86400,
+                        "range": "max",
+                    }}
+                matches = get_rids(catalog, dict(query, **date_query))
+
+                # Exclude those matched by a more specific policy
+                for prev_query in previous:
+                    prev_query = dict(prev_query, **date_query)
+                    matches = difference(matches,
+                                         get_rids(catalog, prev_query))
+
+                rids = union(rids, matches)
+                previous.append(query)
+
+            index = catalog._catalog.getIndex("UID")  # noqa
+            outside.update(map(index.getEntryForObject, rids))
+        return outside
+
+
+def get_retention():
+    """Returns the retention settings, read and parsed only once per request,
+    so guards evaluated for many objects (e.g. in listings) do not read the
+    registry and resolve the policies each time
+    """
+    request = api.get_request()
+    annotations = request is not None and IAnnotations(request, None)
+    if annotations is None or annotations is False:
+        return Retention()
+    retention = annotations.get(RETENTION_STORAGE)
+    if retention is None:
+        retention = Retention()
+        annotations[RETENTION_STORAGE] = retention
+    return retention
+
+
+def get_rids(catalog, query):
+    """Returns a set with the record ids of the catalog that match with the
+    query passed-in
+    """
+    check_indexes(catalog, query.keys())
+    return IITreeSet(map(lambda brain: brain.getRID(), catalog(query)))
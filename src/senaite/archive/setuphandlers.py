@@ -32,6 +32,9 @@ from senaite.archive.config import PROFILE_ID
 from senaite.archive.config import UNINSTALL_ID
 
 from bika.lims import api
+from bika.lims.catalog import BIKA_CATALOG
+from bika.lims.catalog import CATALOG_ANALYSIS_REQUEST_LISTING
+from bika.lims.catalog import CATALOG_WORKSHEET_LISTING
 
 # Tuples of (folder_id, folder_name, type)
 PORTAL_FOLDERS = [
@@ -41,20 +44,37 @@ PORTAL_FOLDERS = [
 INDEXES = [
     # Tuples of (catalog, id, indexed attribute, type)
     (CATALOG_ARCHIVE, "UID", "UUIDIndex"),
+    (CATALOG_ARCHIVE, "item_uid", "FieldIndex"),
     (CATALOG_ARCHIVE, "item_id", "FieldIndex"),
     (CATALOG_ARCHIVE, "item_type", "FieldIndex"),
     (CATALOG_ARCHIVE, "item_created", "DateIndex"),
     (CATALOG_ARCHIVE, "item_modified", "DateIndex"),
-    (CATALOG_ARCHIVE, "listing_searchable_text", "TextIndexNG3"),
+    (CATALOG_ARCHIVE, "item_client", "FieldIndex"),
+    (CATALOG_ARCHIVE, "item_sample_type", "FieldIndex"),
+    (CATALOG_ARCHIVE, "item_review_state", "FieldIndex"),
+    (CATALOG_ARCHIVE, "listing_searchable_text", "ArchiveTextIndex"),
+    (CATALOG_ANALYSIS_REQUEST_LISTING, "related_sample_uids", "KeywordIndex"),
+    (CATALOG_ANALYSIS_REQUEST_LISTING, "last_activity", "DateIndex"),
+    (CATALOG_ANALYSIS_REQUEST_LISTING, "getSampleTypeUID", "FieldIndex"),
+    (CATALOG_WORKSHEET_LISTING, "last_activity", "DateIndex"),
+    (BIKA_CATALOG, "last_activity", "DateIndex"),
 ]
 
 COLUMNS = [
     # Tuples of (catalog, column name)
+    (CATALOG_ARCHIVE, "item_uid"),
     (CATALOG_ARCHIVE, "item_id"),
     (CATALOG_ARCHIVE, "item_type"),
     (CATALOG_ARCHIVE, "item_created"),
     (CATALOG_ARCHIVE, "item_modified"),
     (CATALOG_ARCHIVE, "item_path"),
+    (CATALOG_ARCHIVE, "item_client"),
+    (CATALOG_ARCHIVE, "item_sample_type"),
+    (CATALOG_ARCHIVE, "item_review_state"),
+    (CATALOG_ANALYSIS_REQUEST_LISTING, "related_sample_uids"),
+    (CATALOG_ANALYSIS_REQUEST_LISTING, "last_activity"),
+    (CATALOG_WORKSHEET_LISTING, "last_activity"),
+    (BIKA_CATALOG, "last_activity"),
 ]
 
 CATALOGS_BY_TYPE = [
@@ -153,6 +173,9 @@ def setup_handler(context):
     # Setup catalogs
     setup_catalogs(portal)
 
+    # Setup the queue of archive candidates
+    setup_candidates(portal)
+
     logger.info("{} setup handler [DONE]".format(PRODUCT_NAME.upper()))
 
 
@@ -387,7 +410,18 @@ def add_obj(container, obj_id, obj_name, obj_type):
     return obj
 
 
-def setup_catalogs(portal):
+def setup_candidates(portal):
+    """Initializes the queue of archive candidates, unless initialized already.
+    The queue is kept up-to-date by events, so there is no need to rebuild it
+    each time the profile is imported
+    """
+    from senaite.archive.candidates import ArchiveCandidates
+    candidates = ArchiveCandidates()
+    if candidates.storage is None:
+        candidates.rebuild()
+
+
+def setup_catalogs(portal, indexes=INDEXES, columns=COLUMNS):
     """Setup Plone catalogs
     """
     logger.info("Setup Catalogs ...")
@@ -411,7 +445,7 @@ def setup_catalogs(portal):
 
     # Setup catalog indexes
     logger.info("Setup indexes ...")
-    for catalog_id, name, meta_type in INDEXES:
+    for catalog_id, name, meta_type in indexes:
         catalog = api.get_tool(catalog_id)
         if name in catalog.indexes():
             logger.info("Index '{}' already in '{}'".format(name, catalog_id))
@@ -425,7 +459,7 @@ def setup_catalogs(portal):
 
     # Setup catalog metadata columns
     logger.info("Setup metadata columns ...")
-    for catalog_id, name in COLUMNS:
+    for catalog_id, name in columns:
         catalog = api.get_tool(catalog_id)
         if name in catalog.schema():
             logger.info("Column '{}' already in '{}'".format(name, catalog_id))
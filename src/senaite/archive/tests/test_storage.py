@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.ARCHIVE.
+#
+# SENAITE.ARCHIVE is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+
+from BTrees.OOBTree import OOBTree
+from BTrees.OOBTree import OOTreeSet
+from DateTime import DateTime
+from persistent.mapping import PersistentMapping
+from senaite.archive.candidates import CANDIDATES_STORAGE
+from senaite.archive.candidates import NO_RETENTION
+from senaite.archive.candidates import ArchiveCandidates
+from senaite.archive.histogram import ArchiveHistogram
+from senaite.archive.results import RESULTS_STORAGE
+from senaite.archive.results import ArchiveResults
+from zope.annotation.attribute import AttributeAnnotations
+from zope.annotation.interfaces import IAttributeAnnotatable
+from zope.component import provideAdapter
+from zope.component.testing import setUp
+from zope.component.testing import tearDown
+from zope.interface import implementer
+
+import unittest2 as unittest
+from bika.lims import api
+
+
+@implementer(IAttributeAnnotatable)
+class Archive(object):
+    """Archive folder without contents, falsy as an empty folderish object
+    """
+
+    def __len__(self):
+        return 0
+
+
+class Item(object):
+    """Archive item with the attributes the histogram is computed from
+    """
+
+    def __init__(self, created, item_type):
+        self.item_created = DateTime(created)
+        self.item_type = item_type
+
+
+class Retention(object):
+    """Retention without policies nor default retention period
+    """
+    max_threshold = None
+
+
+class TestStorage(unittest.TestCase):
+    """Tests that the data stored in the annotations of the archive folder is
+    seen by subsequent instances, even if the archive folder is empty
+    """
+
+    def setUp(self):
+        setUp()
+        provideAdapter(AttributeAnnotations)
+        self.portal = {"archive": Archive()}
+        self._get_portal = api.get_portal
+        api.get_portal = lambda: self.portal
+
+    def tearDown(self):
+        api.get_portal = self._get_portal
+        tearDown()
+
+    def test_candidates(self):
+        candidates = ArchiveCandidates()
+        candidates.annotations[CANDIDATES_STORAGE] = PersistentMapping({
+            "criteria": "created",
+            "queue": OOTreeSet(),
+            "keys": OOBTree(),
+        })
+        candidates.storage["queue"].insert((NO_RETENTION, "uid"))
+        candidates.storage["keys"]["uid"] = NO_RETENTION
+
+        candidates = ArchiveCandidates()
+        self.assertTrue(candidates.is_valid("created"))
+        self.assertEqual(candidates.get_eligible(Retention()), ["uid"])
+
+        candidates.discard("uid")
+        candidates = ArchiveCandidates()
+        self.assertEqual(candidates.get_eligible(Retention()), [])
+
+    def test_histogram(self):
+        ArchiveHistogram().add([
+            Item("2019-05-01", "AnalysisRequest"),
+            Item("2019-06-01", "Batch"),
+            Item("2020-01-01", "AnalysisRequest"),
+        ])
+
+        histogram = ArchiveHistogram()
+        self.assertEqual(histogram.get_years(), [(2019, 2), (2020, 1)])
+        self.assertEqual(histogram.get_counter(), 1)
+
+        histogram.remove([Item("2020-01-01", "AnalysisRequest")])
+        histogram = ArchiveHistogram()
+        self.assertEqual(histogram.get_years(), [(2019, 2)])
+        self.assertEqual(histogram.get_counter(), 2)
+
+    def test_results(self):
+        results = ArchiveResults()
+        self.assertEqual(results.get_stats("Ca")["count"], 0)
+        self.assertNotIn(RESULTS_STORAGE, results.annotations)
+
+        results.add([
+            ("Ca", "uid1", DateTime("2019-05-01"), 1.0, "mg/L"),
+            ("Ca", "uid2", DateTime("2019-06-01"), 3.0, "mg/L"),
+            ("Ca", "uid3", DateTime("2020-01-01"), 5.0, "mg/L"),
+        ])
+
+        results = ArchiveResults()
+        self.assertEqual(results.get_keywords(), ["Ca"])
+        self.assertEqual(results.get_years("Ca"), [2019, 2020])
+        stats = results.get_stats("Ca", year=2019)
+        self.assertEqual(stats["count"], 2)
+        self.assertEqual(stats["mean"], 2.0)
+
+        results.remove(["uid3"])
+        results = ArchiveResults()
+        self.assertEqual(results.get_stats("Ca")["count"], 2)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestStorage))
+    return suite
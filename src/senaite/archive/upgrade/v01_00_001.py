@@ -1,8 +1,20 @@
 # -*- coding: utf-8 -*-
+
 from bika.lims import api
+from bika.lims.catalog import BIKA_CATALOG
+from bika.lims.catalog import CATALOG_ANALYSIS_REQUEST_LISTING
+from bika.lims.catalog import CATALOG_WORKSHEET_LISTING
 from senaite.archive import logger
+from senaite.archive.candidates import ArchiveCandidates
+from senaite.archive.catalog import CATALOG_ARCHIVE
 from senaite.archive.config import PRODUCT_NAME
 from senaite.archive.config import PROFILE_ID
+from senaite.archive.histogram import ArchiveHistogram
+from senaite.archive.setuphandlers import COLUMNS
+from senaite.archive.setuphandlers import INDEXES
+from senaite.archive.setuphandlers import commit_transaction
+from senaite.archive.setuphandlers import setup_catalogs as _setup_catalogs
+from senaite.archive.utils import get_summary
 from bika.lims.upgrade import upgradestep
 from bika.lims.upgrade.utils import UpgradeUtils
 
@@ -45,3 +57,164 @@ def setup_archive_workflow(tool):
     wf.updateRoleMappingsFor(archive)
 
     logger.info("Setup archive workflow [DONE]")
+
+
+def setup_catalogs(tool):
+    """Adds the index and metadata column for the resolution of dependents of
+    samples to the samples catalog
+    """
+    logger.info("Setup catalogs ...")
+    portal = tool.aq_inner.aq_parent
+    indexes = filter(lambda idx: idx[1] == "related_sample_uids", INDEXES)
+    columns = filter(lambda col: col[1] == "related_sample_uids", COLUMNS)
+    _setup_catalogs(portal, indexes=indexes, columns=columns)
+    logger.info("Setup catalogs [DONE]")
+
+
+def setup_last_activity(tool):
+    """Adds the last_activity index and metadata column to the catalogs of
+    samples, batches and worksheets and populates them in chunks, with a
+    transaction commit after each chunk
+    """
+    logger.info("Setup last activity ...")
+    portal = tool.aq_inner.aq_parent
+    chunk_size = 1000
+
+    indexes = filter(lambda idx: idx[1] == "last_activity", INDEXES)
+    for catalog_id, name, meta_type in indexes:
+        catalog = api.get_tool(catalog_id)
+        if name not in catalog.indexes():
+            logger.info("Adding index '{}' to '{}'".format(name, catalog_id))
+            catalog.addIndex(name, meta_type)
+
+    columns = filter(lambda col: col[1] == "last_activity", COLUMNS)
+    for catalog_id, name in columns:
+        catalog = api.get_tool(catalog_id)
+        if name not in catalog.schema():
+            logger.info("Adding column '{}' to '{}'".format(name, catalog_id))
+            catalog.addColumn(name)
+
+    # Backfill the index and column, only for the types they are meant for
+    types_catalogs = [
+        ("AnalysisRequest", CATALOG_ANALYSIS_REQUEST_LISTING),
+        ("Batch", BIKA_CATALOG),
+        ("Worksheet", CATALOG_WORKSHEET_LISTING),
+    ]
+    for portal_type, catalog_id in types_catalogs:
+        catalog = api.get_tool(catalog_id)
+        brains = api.search({"portal_type": portal_type}, catalog_id)
+        total = len(brains)
+        for num, brain in enumerate(brains):
+            if num and num % chunk_size == 0:
+                logger.info("Backfilling last activity of {}: {}/{}"
+                            .format(portal_type, num, total))
+                commit_transaction(portal)
+
+            obj = api.get_object(brain)
+            catalog.catalog_object(obj, api.get_path(obj),
+                                   idxs=["last_activity"])
+            obj._p_deactivate()  # noqa
+
+        commit_transaction(portal)
+
+    logger.info("Setup last activity [DONE]")
+
+
+def setup_candidates(tool):
+    """Initializes the queue of archive candidates
+    """
+    logger.info("Setup archive candidates ...")
+    ArchiveCandidates().rebuild()
+    logger.info("Setup archive candidates [DONE]")
+
+
+def setup_retention_policies(tool):
+    """Adds the retention policies setting and the index for the search of
+    samples by sample type
+    """
+    logger.info("Setup retention policies ...")
+    portal = tool.aq_inner.aq_parent
+    setup = portal.portal_setup
+    setup.runImportStepFromProfile(PROFILE_ID, "plone.app.registry")
+
+    indexes = filter(lambda idx: idx[1] == "getSampleTypeUID", INDEXES)
+    _setup_catalogs(portal, indexes=indexes, columns=[])
+    logger.info("Setup retention policies [DONE]")
+
+
+def setup_histogram(tool):
+    """Populates the number of archive items by year and type
+    """
+    logger.info("Setup archive histogram ...")
+    ArchiveHistogram().rebuild()
+    logger.info("Setup archive histogram [DONE]")
+
+
+def setup_facets(tool):
+    """Adds the indexes and metadata columns for the faceted filtering of
+    archive items and populates them from the summary of the items, in chunks
+    """
+    logger.info("Setup archive facets ...")
+    portal = tool.aq_inner.aq_parent
+    chunk_size = 1000
+    facets = {
+        "item_client": "Client",
+        "item_sample_type": "Sample type",
+        "item_review_state": "Status",
+    }
+    indexes = filter(lambda idx: idx[1] in facets, INDEXES)
+    columns = filter(lambda col: col[1] in facets, COLUMNS)
+    _setup_catalogs(portal, indexes=indexes, columns=columns)
+
+    # Backfill the values from the summary the item was created with
+    catalog = api.get_tool(CATALOG_ARCHIVE)
+    brains = api.search({"portal_type": "ArchiveItem"}, CATALOG_ARCHIVE)
+    total = len(brains)
+    for num, brain in enumerate(brains):
+        if num and num % chunk_size == 0:
+            logger.info("Backfilling archive facets: {}/{}"
+                        .format(num, total))
+            commit_transaction(portal)
+
+        obj = api.get_object(brain)
+        summary = get_summary(obj)
+        for name, key in facets.items():
+            setattr(obj, name, summary.get(key, ""))
+        catalog.catalog_object(obj, api.get_path(obj), idxs=facets.keys())
+        obj._p_deactivate()  # noqa
+
+    commit_transaction(portal)
+    logger.info("Setup archive facets [DONE]")
+
+
+def setup_text_index(tool):
+    """Replaces the TextIndexNG3 index for the searchable text of archive
+    items by an ArchiveTextIndex and reindexes the archive items. Searches can
+    be timed afterwards with the archive_benchmark command
+    """
+    logger.info("Setup archive text index ...")
+    portal = tool.aq_inner.aq_parent
+    name = "listing_searchable_text"
+    catalog = api.get_tool(CATALOG_ARCHIVE)
+    index = catalog._catalog.getIndex(name)  # noqa
+    if index.meta_type == "ArchiveTextIndex":
+        logger.info("Index '{}' is an ArchiveTextIndex already".format(name))
+        return
+
+    logger.info("Removing index '{}' ({})".format(name, index.meta_type))
+    catalog.delIndex(name)
+    indexes = filter(lambda idx: idx[1] == name, INDEXES)
+    _setup_catalogs(portal, indexes=indexes, columns=[])
+    logger.info("Setup archive text index [DONE]")
+
+
+def setup_item_uid(tool):
+    """Adds the index and metadata column for the search of archive items by
+    the UID of the original object
+    """
+    logger.info("Setup archive item UID ...")
+    portal = tool.aq_inner.aq_parent
+    indexes = filter(lambda idx: idx[1] == "item_uid", INDEXES)
+    columns = filter(lambda col: col[1] == "item_uid", COLUMNS)
+    _setup_catalogs(portal, indexes=indexes, columns=columns)
+    logger.info("Setup archive item UID [DONE]")
@@ -18,7 +18,10 @@
 # Copyright 2021 by it's authors.
 # Some rights reserved, see README and LICENSE.
 
+import glob
 import os
+import re
+from collections import defaultdict
 import six
 from Acquisition import aq_base
 from datetime import datetime
@@ -27,23 +30,22 @@ from plone.app.textfield import RichTextValue
 from Products.Archetypes.config import UID_CATALOG
 from Products.GenericSetup.context import DirectoryExportContext
 from senaite.archive import logger
+from senaite.archive.chunk import archive_chunk
+from senaite.archive.chunk import get_chunk
 from senaite.archive.config import PRODUCT_NAME
 from senaite.archive.config import QUEUE_TASK_ID
 from senaite.archive.interfaces import IArchiveDataProvider
-from senaite.archive.interfaces import IForArchiving
+from senaite.archive.interfaces import IArchiveExportContext
 from zope.component import getMultiAdapter
-from zope.interface import alsoProvides
-from zope.interface import noLongerProvides
+from zope.interface import implementer
 
 from bika.lims import api
 from bika.lims.catalog import BIKA_CATALOG
+from bika.lims.catalog import CATALOG_ANALYSIS_LISTING
 from bika.lims.catalog import CATALOG_ANALYSIS_REQUEST_LISTING
 from bika.lims.catalog import CATALOG_WORKSHEET_LISTING
 from bika.lims.exportimport.genericsetup.structure import exportObjects
 from bika.lims.interfaces import IAnalysisRequest
-from bika.lims.interfaces import IAuditable
-from bika.lims.interfaces import IBatch
-from bika.lims.interfaces import IWorksheet
 from bika.lims.workflow import doActionFor as do_action_for
 from bika.lims.workflow import isTransitionAllowed
 
@@ -55,6 +57,13 @@ except:
     is_queue_ready = None
     add_task = None
 
+# Catalogs to use for searches, by portal type
+SEARCH_CATALOGS = {
+    "AnalysisRequest": CATALOG_ANALYSIS_REQUEST_LISTING,
+    "Worksheet": CATALOG_WORKSHEET_LISTING,
+    "Batch": BIKA_CATALOG,
+}
+
 
 def can_archive(obj):
     """Returns whether the object can be archived
@@ -88,45 +97,121 @@ def archive_old_objects(context=None):  # noqa context is required by genericset
     """Archives (and deletes) all archive-able objects from the system that are
     older than the retention period. This function is used by the generic setup
     """
-    for obj in archivable_objects():
-        do_action_for(obj, "archive")
+    archive_objects(archive_candidates())
 
 
-def search(portal_type):
-    """Search items from the given portal type
+def archive_objects(objects):
+    """Archives the objects passed-in, together with their dependents, within
+    a single chunk. The dependencies are resolved beforehand, so each object is
+    archived only once and after its dependents
+    """
+    with archive_chunk() as chunk:
+        failed = set()
+        for obj in chunk.plan(objects):
+            if api.get_uid(obj) in failed:
+                # A dependent could not be archived
+                continue
+            if chunk.is_archiving(obj):
+                # Archived already as part of another object's hierarchy
+                continue
+            success, message = do_action_for(obj, "archive")
+            if not success:
+                logger.warn("Cannot archive {}: {}".format(
+                    api.get_path(obj), message))
+                failed.update(chunk.unplan(obj))
+
+
+def get_catalog_for(portal_type):
+    """Returns the id of the catalog to use for searches of the portal type
+    """
+    return SEARCH_CATALOGS.get(portal_type, UID_CATALOG)
+
+
+def search(portal_type, review_state=None, **kwargs):
+    """Search items from the given portal type, optionally filtered by status
+    and additional criteria
     """
-    mappings = {
-        "AnalysisRequest": CATALOG_ANALYSIS_REQUEST_LISTING,
-        "Worksheet": CATALOG_WORKSHEET_LISTING,
-        "Batch": BIKA_CATALOG,
-    }
     query = {"portal_type": portal_type}
-    catalog = mappings.get(portal_type, UID_CATALOG)
-    if portal_type in mappings:
+    catalog = get_catalog_for(portal_type)
+    if portal_type in SEARCH_CATALOGS:
         query.update({
             "sort_on": "created",
             "sort_order": "ascending",
         })
+        if review_state:
+            query["review_state"] = review_state
+        query.update(kwargs)
     return api.search(query, catalog)
 
 
+def get_archivable_states(portal_type):
+    """Returns the ids of the workflow states from which the objects of the
+    given portal type can be archived
+    """
+    states = []
+    wf_tool = api.get_tool("portal_workflow")
+    for wf_id in wf_tool.getChainForPortalType(portal_type):
+        workflow = wf_tool.getWorkflowById(wf_id)
+        for state in workflow.states.objectValues():
+            if "archive" in state.transitions:
+                states.append(state.getId())
+    return states
+
+
+def has_archive_transition(obj):
+    """Returns whether the current status of the object has the transition
+    "archive" available, regardless of the guard
+    """
+    wf_tool = api.get_tool("portal_workflow")
+    for workflow in wf_tool.getWorkflowsFor(obj):
+        state = workflow._getWorkflowStateOf(obj)  # noqa
+        if state and "archive" in state.transitions:
+            return True
+    return False
+
+
+def archive_candidates():
+    """Returns an enumerator with the objects their type is suitable for
+    archival, are in a status from which they can be archived and are outside
+    of the retention period
+    """
+    from senaite.archive.candidates import get_candidates
+    return get_candidates()
+
+
 def archivable_objects(limit=-1):
-    """Returns an enumerator with objects their type is suitable for archival
-    and they are outside of the retention period
-    """
-    # We sort by portal type so we are sure that Samples are processed first
-    num_objs = 0
-    portal_types = ["AnalysisRequest", "Batch", "Worksheet"]
-    for portal_type in portal_types:
-        if 0 < limit <= num_objs:
-            break
-        for obj in search(portal_type):
-            if 0 < limit <= num_objs:
-                break
-            obj = api.get_object(obj)
-            if can_archive(obj):
-                num_objs += 1
-                yield obj
+    """Returns the list of objects that can be archived, sorted so that each
+    object comes after its dependents and objects that share a client, batch
+    or worksheet are next to each other. The list is a prefix of the archival
+    plan that does not split clusters, so it can be archived in isolation
+    """
+    from senaite.archive.planner import ArchivePlanner
+    planner = ArchivePlanner()
+    candidates = []
+    threshold = limit
+    for obj in archive_candidates():
+        candidates.append(obj)
+        if 0 < threshold <= len(planner) + len(candidates):
+            # Dependents of candidates are resolved in bulk
+            planner.extend(candidates)
+            candidates = []
+            if len(planner) < limit:
+                continue
+
+            # Objects that cannot be archived are excluded from the plan, so
+            # we might need more candidates to fill the limit
+            planner.add_related()
+            plan = planner.plan()
+            if len(plan) >= limit:
+                return planner.cut(plan, limit)
+            threshold = len(planner) + limit
+
+    planner.extend(candidates)
+    planner.add_related()
+    plan = planner.plan()
+    if limit > 0:
+        return planner.cut(plan, limit)
+    return plan
 
 
 def do_archive():
@@ -170,19 +255,29 @@ def archive_object(obj):
     """Archives an deletes an object, while creating a new lightweight object
     representing the former and only used for historical searches
     """
+    with archive_chunk():
+        _archive_object(obj)
+
+
+def _archive_object(obj):
+    """Archives an deletes an object. Must be called within an archive chunk
+    """
     # Archive object dependents (back references) first. Won't be possible to
-    # delete the object otherwise
-    for dep in get_archiving_dependents(obj):
-        do_action_for(dep, "archive")
-
-    # Mark the object and its children with IForArchiving interface, so the
-    # generic setup export machinery does not dismiss them when exporting the
-    # contents into XML files. See monkeys/genericsetup/can_export
-    # Also, remove the IAuditable so no record in auditlog catalog is created
-    for ob in extract(obj):
-        if can_archive(ob):
-            alsoProvides(ob, IForArchiving)
-            noLongerProvides(ob, IAuditable)
+    # delete the object otherwise. If the archival of the object was planned,
+    # its dependents have been archived already
+    chunk = get_chunk()
+    if not chunk.is_planned(obj):
+        for dep in get_archiving_dependents(obj):
+            do_action_for(dep, "archive")
+
+    # Flag the object and its children as being archived, so the generic setup
+    # export machinery does not dismiss them when exporting the contents into
+    # XML files (see monkeys/genericsetup/can_export) and no snapshots are
+    # taken for them (see monkeys/auditlog/supports_snapshots). The flag lives
+    # in the chunk, so the objects are not modified. The hierarchy is extracted
+    # only once, for both the flagging and the deletion
+    hierarchy = extract(obj)
+    chunk.mark(hierarchy)
 
     # Do a transaction savepoint
     #transaction.savepoint(optimistic=True)
@@ -194,14 +289,34 @@ def archive_object(obj):
 
     # Create the ArchiveItem object, a DT lightweight object with it's own
     # catalog , used for historical searches
-    create_archive_item(obj, "/{}".format(archive_path))
+    create_archive_item(obj, "/{}".format(archive_path), chunk)
 
     # Definitely remove (and uncatalog) the object
-    delete(obj)
+    delete(obj, hierarchy=hierarchy)
+
+
+# Matches the key-value pairs of the summary of archive items
+SUMMARY_RE = re.compile(r"<li><strong>(.*?)</strong>: (.*?)</li>", re.DOTALL)
+
+
+def parse_summary(html):
+    """Returns a dict with the key-value pairs from the HTML summary of an
+    archive item
+    """
+    return dict(SUMMARY_RE.findall(html or ""))
+
+
+def get_summary(item):
+    """Returns a dict with the key-value pairs of the summary the archive item
+    passed-in was created with
+    """
+    item_data = getattr(item, "item_data", None)
+    return parse_summary(item_data and item_data.raw or "")
 
 
-def create_archive_item(obj, archive_path):
-    """Creates an archive item that represents the object passed-in
+def create_archive_item(obj, archive_path, chunk):
+    """Creates an archive item that represents the object passed-in. The item
+    is indexed when the chunk passed-in gets flushed
     """
     # Extract the data from the object with the proper adapter
     request = api.get_request()
@@ -228,41 +343,72 @@ def create_archive_item(obj, archive_path):
     # Giving the field values on creation saves a reindex after edition
     field_values = dict(
         title=api.get_title(obj),
+        item_uid=api.get_uid(obj),
         item_id=api.get_id(obj),
         item_path=api.get_path(obj),
         item_type=api.get_portal_type(obj),
         item_created=api.get_creation_date(obj),
         item_modified=get_last_modification_date(obj),
+        item_client=item_data.get("Client", ""),
+        item_sample_type=item_data.get("Sample type", ""),
+        item_review_state=api.get_review_status(obj),
         item_data=html,
         archive_path=archive_path,
         search_text=search_text,
         exclude_from_nav=True
     )
     archive = api.get_portal().archive
-    return api.create(archive, "ArchiveItem", **field_values)
+
+    # Create the item without events. It will be indexed when the chunk flushes
+    chunk.add_results(obj)
+    return chunk.create_item(archive, "ArchiveItem", **field_values)
 
 
 def get_archiving_dependents(obj):
     """Returns a list of objects that need to be archived before the obj
     """
-    refs = []
     if IAnalysisRequest.providedBy(obj):
-        # Retests
-        refs.append(obj.get_retest())
+        # Retests, secondaries and partitions (descendants)
+        uid = api.get_uid(obj)
+        uids = get_dependents_uids([uid]).get(uid, [])
+        return get_objects(uids)
 
-        # Secondaries
-        secondaries = obj.getSecondaryAnalysisRequests() or []
-        refs.extend(secondaries)
+    # Extract the samples from Worksheet, Batch
+    return get_samples(obj)
 
-        # Descendants
-        descendants = obj.getDescendants() or []
-        refs.extend(descendants)
 
-    else:
-        # Extract the samples from Worksheet, Batch
-        refs = get_samples(obj)
-
-    return filter(None, refs)
+def get_dependents_uids(uids):
+    """Returns a dict with the UIDs of the samples that need to be archived
+    before each of the samples passed-in (retests, secondaries and partitions),
+    keyed by sample UID. Resolved with a single catalog search, without waking
+    up any sample
+    """
+    dependents = defaultdict(list)
+    uids = set(filter(None, uids))
+    if not uids:
+        return dependents
+
+    # ZCatalog ignores unknown indexes and would return all samples
+    catalog = api.get_tool(CATALOG_ANALYSIS_REQUEST_LISTING)
+    check_indexes(catalog, ["related_sample_uids"])
+    query = {"related_sample_uids": list(uids)}
+    brains = catalog(query)
+    for brain in brains:
+        related = set(brain.related_sample_uids or [])
+        for uid in related.intersection(uids):
+            dependents[uid].append(brain.UID)
+    return dependents
+
+
+def check_indexes(catalog, names):
+    """Raises a RuntimeError if any of the indexes passed-in is missing in the
+    catalog. Queries with unknown indexes are not filtered by them
+    """
+    missing = filter(lambda name: name not in catalog.indexes(), names)
+    if missing:
+        raise RuntimeError(
+            "Indexes {} missing in {}. Please run the setup of {}".format(
+                ", ".join(missing), catalog.id, PRODUCT_NAME))
 
 
 def get_retention_period():
@@ -279,24 +425,19 @@ def get_retention_date_criteria():
     return api.get_registry_record(key)
 
 
+def get_retention_policies():
+    """Returns the retention policies set in the configuration panel
+    """
+    key = "{}.retention_policies".format(PRODUCT_NAME)
+    return api.get_registry_record(key)
+
+
 def is_outside_retention_period(obj):
     """Returns whether the given object is outside the retention period based on
     the date criteria and retention period set in the configuration panel.
     """
-    retention_period = get_retention_period()
-    if retention_period is None:
-        # If no retention period is set, retain the object
-        return False
-
-    # Assume object's creation date as default threshold criteria
-    obj_date = api.get_creation_date(obj)
-    criteria = get_retention_date_criteria()
-    if criteria == "modified":
-        obj_date = get_last_modification_date(obj)
-
-    # Check if the object is old enough
-    threshold_year = datetime.now().year - retention_period
-    return obj_date.year() <= threshold_year
+    from senaite.archive.retention import get_retention
+    return get_retention().is_outside(obj)
 
 
 def get_last_modification_date(obj):
@@ -331,6 +472,23 @@ def get_archive_relative_path(obj):
     return "{}{}/".format(created, parent_path)
 
 
+def get_archived_files(item):
+    """Returns the sorted list of absolute paths of the files the object
+    represented by the archive item passed-in was exported to: the file of the
+    object itself and those of its contents, if any
+    """
+    base_path = get_archive_base_path()
+    parent_path = os.path.join(base_path, item.archive_path.strip("/"))
+    if not os.path.isdir(parent_path):
+        return []
+
+    item_id = item.item_id
+    files = glob.glob(os.path.join(parent_path, "{}.*".format(item_id)))
+    for root, dirs, names in os.walk(os.path.join(parent_path, item_id)):
+        files.extend(map(lambda name: os.path.join(root, name), names))
+    return sorted(files)
+
+
 def get_export_context():
     """Returns the export context to use for archiving
     """
@@ -339,33 +497,79 @@ def get_export_context():
     return ArchiveDirectoryExportContext(portal.portal_setup, base_path)
 
 
-def delete(obj):
+def delete(obj, hierarchy=None):
     """Deletes and un-catalog the object passed-in, as well as all the objects
-    it contains within its hierarchy
+    it contains within its hierarchy. If the hierarchy of objects (sorted from
+    deepest to shallowest) is already known, it can be passed-in
     """
-    # Un-catalog all objects from the hierarchy first
-    for ob in extract(obj):
-        ob_path = api.get_path(ob)
-        catalogs = api.get_catalogs_for(ob)
-        map(lambda cat: cat.uncatalog_object(ob_path), catalogs)
+    if hierarchy is None:
+        hierarchy = walk(obj)
 
-    # Remove the object
-    obj_id = api.get_id(obj)
-    parent = api.get_parent(obj)
-    parent._delObject(obj_id) # Noqa
+    with archive_chunk() as chunk:
+        # Un-catalog all objects from the hierarchy first, one catalog at once.
+        # The chunk keeps track of the uncatalogued objects, so the delete
+        # events do not uncatalog them again
+        chunk.uncatalog(hierarchy)
+
+        # Remove the object
+        obj_id = api.get_id(obj)
+        parent = api.get_parent(obj)
+        parent._delObject(obj_id)  # noqa
 
 
 def extract(obj):
     """Extracts the objects contained within the hierarchy of the obj passed-in,
     sorted from deepest to shallowest
     """
-    objects = []
-    if hasattr(aq_base(obj), "objectValues"):
-        for child_obj in obj.objectValues():
-            children = extract(child_obj)
-            objects.extend(children)
-    objects.append(obj)
-    return objects
+    return list(walk(obj))
+
+
+def walk(obj):
+    """Generator that yields the objects contained within the hierarchy of the
+    obj passed-in, sorted from deepest to shallowest. The hierarchy is walked
+    iteratively, so deep hierarchies do not hit the recursion limit
+    """
+    # Stack of (object, expanded) tuples. An object is yielded once all its
+    # children have been yielded already
+    stack = [(obj, False)]
+    while stack:
+        ob, expanded = stack.pop()
+        if expanded:
+            yield ob
+            continue
+
+        stack.append((ob, True))
+        if hasattr(aq_base(ob), "objectValues"):
+            children = ob.objectValues()
+            stack.extend([(child, False) for child in reversed(children)])
+
+
+def get_objects(uids):
+    """Returns the objects for the given UIDs, sorted in the same order. The
+    paths are resolved with a single search against the UID catalog and the
+    objects are grouped by container, so each container is traversed once
+    instead of once per object (e.g. samples from the same client)
+    """
+    brains = api.search({"UID": uids}, UID_CATALOG)
+
+    # Group the ids of the objects by the path of their container
+    ids_by_parent = defaultdict(list)
+    for brain in brains:
+        parent_path, _, obj_id = brain.getPath().rpartition("/")
+        ids_by_parent[parent_path].append(obj_id)
+
+    objects = {}
+    portal = api.get_portal()
+    for parent_path, ids in ids_by_parent.items():
+        parent = portal.unrestrictedTraverse(parent_path, None)
+        if parent is None:
+            continue
+        for obj_id in ids:
+            obj = parent._getOb(obj_id, None)  # noqa
+            if obj is not None:
+                objects[api.get_uid(obj)] = obj
+
+    return filter(None, map(objects.get, uids))
 
 
 def to_field_datetime(value):
@@ -393,25 +597,69 @@ def to_field_datetime(value):
 def get_samples(obj):
     """Returns the samples assigned to the obj passed-in
     """
-    samples = []
-    if IBatch.providedBy(obj):
-        # Contained Samples
-        query = {"getBatchUID": api.get_uid(obj)}
-        samples = api.search(query, CATALOG_ANALYSIS_REQUEST_LISTING)
-        samples = map(api.get_object, samples)
-
-    elif IWorksheet.providedBy(obj):
-        # Samples assigned to this worksheet through its analyses
-        uids = map(lambda l: l.get("container_uid"), obj.getLayout())
-        uids = filter(None, uids)
-        if uids:
-            query = {"UID": uids}
-            samples = api.search(query, CATALOG_ANALYSIS_REQUEST_LISTING)
-            samples = map(api.get_object, samples)
+    uid = api.get_uid(obj)
+    brains = get_samples_brains([uid]).get(uid, [])
+    return get_objects(map(api.get_uid, brains))
+
+
+def get_samples_brains(uids):
+    """Returns a dict with the brains of the samples assigned to each of the
+    batches or worksheets passed-in, keyed by the UID of the batch/worksheet.
+    Samples from all batches and worksheets are resolved at once, without
+    waking up neither the samples nor the analyses
+    """
+    samples = defaultdict(list)
+    uids = filter(None, set(uids))
+    if not uids:
+        return samples
+
+    # Samples from batches
+    query = {"getBatchUID": uids}
+    for brain in api.search(query, CATALOG_ANALYSIS_REQUEST_LISTING):
+        samples[brain.getBatchUID].append(brain)
+
+    # Samples from worksheets, through their analyses
+    catalog = api.get_tool(CATALOG_ANALYSIS_LISTING)
+    index = catalog._catalog.getIndex("getWorksheetUID")  # noqa
+    query = {"portal_type": "Analysis", "getWorksheetUID": uids}
+    worksheets = defaultdict(set)
+    for brain in catalog(query):
+        ws_uid = index.getEntryForObject(brain.getRID(), None)
+        worksheets[ws_uid].add(brain.getParentUID)
+
+    samples_uids = set().union(*worksheets.values())
+    if samples_uids:
+        query = {"UID": list(samples_uids)}
+        brains = api.search(query, CATALOG_ANALYSIS_REQUEST_LISTING)
+        brains = dict(map(lambda brain: (brain.UID, brain), brains))
+        for ws_uid, ws_samples in worksheets.items():
+            ws_samples = filter(None, map(brains.get, ws_samples))
+            samples[ws_uid].extend(ws_samples)
 
     return samples
 
 
+def get_worksheets_uids(uids):
+    """Returns a dict with the UIDs of the worksheets each sample passed-in has
+    analyses assigned to, keyed by sample UID. Resolved with a single catalog
+    search, without waking up neither the analyses nor the worksheets
+    """
+    worksheets = defaultdict(set)
+    uids = filter(None, set(uids))
+    if not uids:
+        return worksheets
+
+    catalog = api.get_tool(CATALOG_ANALYSIS_LISTING)
+    index = catalog._catalog.getIndex("getWorksheetUID")  # noqa
+    query = {"portal_type": "Analysis", "getParentUID": uids}
+    for brain in catalog(query):
+        ws_uid = index.getEntryForObject(brain.getRID(), None)
+        if ws_uid:
+            worksheets[brain.getParentUID].add(ws_uid)
+    return worksheets
+
+
+@implementer(IArchiveExportContext)
 class ArchiveDirectoryExportContext(DirectoryExportContext):
 
     def get_file_path(self, filename, subdir=None):
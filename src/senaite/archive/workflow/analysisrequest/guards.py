@@ -19,6 +19,7 @@
 # Some rights reserved, see README and LICENSE.
 
 from senaite.archive import is_installed
+from senaite.archive.chunk import is_planned
 from senaite.archive.utils import get_archiving_dependents
 from senaite.archive.utils import is_outside_retention_period
 
@@ -35,6 +36,10 @@ def guard_archive(sample):
     if not is_installed():
         return False
 
+    # Dependencies were already resolved when the archival was planned
+    if is_planned(sample):
+        return True
+
     # Check if the object is outside the retention period
     if not is_outside_retention_period(sample):
         return False
@@ -19,7 +19,10 @@
 # Some rights reserved, see README and LICENSE.
 
 from senaite.archive import is_installed
-from senaite.archive.utils import get_samples
+from senaite.archive.chunk import is_planned
+from senaite.archive.restored import is_restored
+from senaite.archive.utils import get_archivable_states
+from senaite.archive.utils import get_samples_brains
 
 from bika.lims import api
 from bika.lims.workflow import isTransitionAllowed
@@ -33,9 +36,24 @@ def guard_archive(worksheet):
     if not is_installed():
         return False
 
-    # Get the Samples from the worksheet
-    for sample in get_samples(worksheet):
-        sample = api.get_object(sample)
+    # Dependencies were already resolved when the archival was planned
+    if is_planned(worksheet):
+        return True
+
+    # Restored objects are kept out of the archival
+    if is_restored(worksheet):
+        return False
+
+    # Get the Samples from the worksheet. Samples that are not in a status from
+    # which they can be archived are discarded without waking them up
+    states = get_archivable_states("AnalysisRequest")
+    uid = api.get_uid(worksheet)
+    brains = get_samples_brains([uid]).get(uid, [])
+    for brain in brains:
+        if api.get_review_status(brain) not in states:
+            return False
+
+    for sample in map(api.get_object, brains):
         if not isTransitionAllowed(sample, "archive"):
             return False
 